@@ -0,0 +1,110 @@
+"""
+Concierge Bot Asincrono
+Interfaccia asyncio per servire molte sessioni di chat da un solo processo
+"""
+import asyncio
+import functools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from concierge_bot import HotelConciergeBot
+
+
+class AsyncHotelConciergeBot(HotelConciergeBot):
+    """
+    Variante asyncio di HotelConciergeBot.
+    
+    Il lavoro bloccante di ogni messaggio (retrieval CPU-bound, query e
+    scritture SQLite) gira in un thread pool dedicato, quindi l'event loop
+    resta libero di servire altre sessioni mentre un ospite attende il
+    database. I messaggi dello stesso ospite vengono serializzati con un
+    lock asyncio per sessione, così storia e contatori di escalation
+    restano nell'ordine di arrivo.
+    
+    Examples:
+        >>> async def main():
+        ...     async with AsyncHotelConciergeBot(max_workers=16) as bot:
+        ...         return await bot.process_guest_message_async(
+        ...             "A che ora è la colazione?",
+        ...             guest_info={"guest_id": "G001", "room_number": "305",
+        ...                         "language": "it", "preferences": {}}
+        ...         )
+        >>> response = asyncio.run(main())
+    
+    Note:
+        - Le API sincrone della classe base restano disponibili
+        - max_workers limita le chiamate bloccanti contemporanee (e quindi le
+          connessioni SQLite aperte dal pool, una per thread)
+    """
+    
+    def __init__(self, *args, max_workers: int = 8, **kwargs):
+        """
+        Args:
+            *args, **kwargs: Parametri di HotelConciergeBot
+            max_workers: Thread del pool per il lavoro bloccante
+        """
+        super().__init__(*args, **kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="concierge")
+        
+        # Un lock per ospite, rilasciato dal GC quando nessun messaggio è in corso
+        self._session_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+    
+    def _session_lock(self, guest_id: str) -> asyncio.Lock:
+        lock = self._session_locks.get(guest_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._session_locks[guest_id] = lock
+        return lock
+    
+    async def process_guest_message_async(
+        self,
+        message: str,
+        conversation_history: Optional[List[Dict]] = None,
+        guest_info: Optional[Dict] = None
+    ) -> str:
+        """
+        Versione asincrona di process_guest_message.
+        
+        Args:
+            message: Messaggio dell'ospite
+            conversation_history: Storia conversazione (opzionale, vedi process_guest_message)
+            guest_info: Informazioni ospite
+        
+        Returns:
+            str: Risposta del bot
+        """
+        guest_info = guest_info or {}
+        loop = asyncio.get_running_loop()
+        call = functools.partial(self.process_guest_message, message, conversation_history, guest_info)
+        
+        guest_id = guest_info.get('guest_id')
+        if guest_id is None:
+            # Chiamante anonimo: nessuno stato di sessione da serializzare
+            return await loop.run_in_executor(self.executor, call)
+        
+        async with self._session_lock(guest_id):
+            return await loop.run_in_executor(self.executor, call)
+    
+    async def get_personalized_recommendations_async(
+        self,
+        guest_info: Dict,
+        category: str,
+        as_dicts: bool = False
+    ) -> List[Dict]:
+        """Versione asincrona di get_personalized_recommendations"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self.get_personalized_recommendations, guest_info, category, as_dicts
+        )
+    
+    def close(self):
+        """Attende le chiamate in corso, poi chiude writer e thread pool"""
+        self.executor.shutdown(wait=True)
+        super().close()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
@@ -2,15 +2,28 @@
 Sistema Conversazionale Hotel Concierge Bot
 Orchestrazione completa con intent classification, RAG e service management
 """
-import json
-import sqlite3
+import threading
 from typing import List, Dict, Optional
 from pathlib import Path
 
 # Import moduli locali
-from intent_classifier import classify_guest_intent, get_intent_confidence
-from rag_engine import search_hotel_knowledge, generate_concierge_response, load_knowledge_base
-from service_manager import create_service_request, get_request_status, format_service_confirmation, get_guest_requests
+from intent_classifier import analyze_guest_message, ClassificationResult
+from keyword_matcher import (
+    SHARED_MATCHER, RECOMMENDATION_CATEGORY_KEYWORDS, SERVICE_TYPE_KEYWORDS,
+    COMPLAINT_ESCALATION_KEYWORDS
+)
+from rag_engine import (
+    search_hotel_knowledge, generate_concierge_response, load_knowledge_base,
+    KnowledgeIndex, KnowledgeSnapshot, QueryCache, ResponseCache, rescore_results,
+    results_as_dicts
+)
+from service_manager import (
+    create_service_request, get_request_status, format_service_confirmation,
+    get_guest_requests, initialize_database
+)
+from conversation_store import ConversationStore, ConversationWriter
+from escalation_tracker import EscalationTracker, ESCALATION_ROLE
+from kb_watcher import KnowledgeBaseWatcher
 
 
 class HotelConciergeBot:
@@ -23,43 +36,271 @@ class HotelConciergeBot:
         - Service request management
         - Personalized recommendations
         - Auto-escalation to human staff
+    
+    Thread safety:
+        Un'istanza può essere condivisa tra i thread di un worker (WSGI):
+        KB e indice sono uno snapshot immutabile letto senza lock, cache,
+        sessioni e contatori sono protetti da lock interni e il database usa
+        connessioni thread-local verso self.db_path. I messaggi concorrenti
+        dello stesso ospite non hanno un ordine garantito: serializzarli a
+        monte (es. AsyncHotelConciergeBot)
     """
     
-    def __init__(self, kb_path: str = "data/hotel_knowledge_base.json", db_path: str = "data/hotel_database.sqlite"):
+    def __init__(
+        self,
+        kb_path: str = "data/hotel_knowledge_base.json",
+        db_path: str = "data/hotel_database.sqlite",
+        index_path: Optional[str] = None,
+        cache_max_entries: int = 256,
+        cache_ttl_seconds: float = 300.0,
+        response_cache_size: int = 512,
+        write_behind: bool = True,
+        history_size: int = 20,
+        escalation_tracker: Optional[EscalationTracker] = None,
+        watch_kb: bool = False,
+        watch_interval: float = 2.0
+    ):
         """
         Inizializza il bot con knowledge base e database.
         
         Args:
             kb_path: Path al file JSON della knowledge base
             db_path: Path al database SQLite
+            index_path: Path del file .npz con l'indice TF-IDF (opzionale).
+                        Se valido viene caricato, altrimenti l'indice viene
+                        fittato e salvato lì per i riavvii successivi
+            cache_max_entries: Dimensione massima della cache query (0 = disabilitata)
+            cache_ttl_seconds: Validità in secondi dei risultati in cache
+            response_cache_size: Dimensione del memo delle risposte renderizzate
+                                 (0 = disabilitato)
+            write_behind: Se True le conversazioni vengono salvate da un writer
+                          in background (chiamare close() allo shutdown)
+            history_size: Messaggi di storia tenuti in memoria per sessione
+            escalation_tracker: Tracker con soglie di escalation personalizzate
+                                (default: soglie standard)
+            watch_kb: Se True un watcher ricarica la KB quando il file cambia
+                      (rebuild in background e swap atomico dell'indice)
+            watch_interval: Secondi tra due controlli del file KB
         """
+        self.kb_path = kb_path
+        self.index_path = index_path
+        self._reload_lock = threading.Lock()
+        
         # Carica knowledge base
         try:
-            self.kb_data = load_knowledge_base(kb_path)
-            print(f"✓ Knowledge base caricata: {len(self.kb_data)} documenti")
+            kb_data = load_knowledge_base(kb_path)
+            print(f"✓ Knowledge base caricata: {len(kb_data)} documenti")
         except Exception as e:
             print(f"⚠️ Errore caricamento KB: {e}")
-            self.kb_data = []
+            kb_data = []
+        
+        # Snapshot immutabile KB + indice (fittato una sola volta)
+        self._knowledge = KnowledgeSnapshot(kb_data, self._build_index(kb_data, index_path))
+        
+        # Cache risultati (invalidata automaticamente se il file KB cambia)
+        self.query_cache = QueryCache(
+            max_entries=cache_max_entries,
+            ttl_seconds=cache_ttl_seconds,
+            source_path=kb_path
+        )
+        
+        # Memo delle risposte già formattate (FAQ più frequenti)
+        self.response_cache = ResponseCache(response_cache_size) if response_cache_size > 0 else None
         
         self.db_path = db_path
         
-        # Statistiche conversazione
-        self.failed_intents_count = {}  # Track per escalation
+        # Bootstrap schema una sola volta all'avvio (fuori dall'hot path)
+        try:
+            initialize_database(self.db_path)
+        except Exception as e:
+            print(f"⚠️ Errore inizializzazione database: {e}")
+        
+        # Logging conversazioni fuori dal percorso di risposta
+        self.conversation_writer = ConversationWriter(db_path) if write_behind else None
+        
+        # Sessioni di conversazione persistenti (un conversation_id per ospite)
+        self.conversation_store = ConversationStore(
+            db_path, writer=self.conversation_writer, history_size=history_size
+        )
+        
+        # Contatori di escalation per sessione
+        self.escalation_tracker = escalation_tracker or EscalationTracker()
+        
+        # Hot reload della KB senza riavvio
+        self.kb_watcher = None
+        if watch_kb:
+            self.kb_watcher = KnowledgeBaseWatcher(kb_path, self.reload_knowledge_base, watch_interval)
+            self.kb_watcher.start()
+        
+    def close(self):
+        """Ferma watcher KB e writer in background, scrivendo le conversazioni pendenti"""
+        if self.kb_watcher is not None:
+            self.kb_watcher.stop()
+        if self.conversation_writer is not None:
+            self.conversation_writer.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    @property
+    def kb_data(self) -> list:
+        """Knowledge base dello snapshot corrente (read-only)"""
+        return self._knowledge.kb_data
+    
+    @property
+    def index(self) -> Optional[KnowledgeIndex]:
+        """Indice di ricerca dello snapshot corrente"""
+        return self._knowledge.index
+    
+    def reload_knowledge_base(self) -> int:
+        """
+        Ricarica KB e indice da kb_path e li pubblica con uno swap atomico.
+        
+        Il nuovo indice viene costruito per intero prima dello swap: le query
+        in corso continuano sullo snapshot precedente e nessuna vede un
+        indice a metà.
         
+        Returns:
+            int: Versione del nuovo snapshot
+        
+        Raises:
+            Exception: Se il file KB non è valido (lo snapshot corrente resta attivo)
+        """
+        with self._reload_lock:
+            kb_data = load_knowledge_base(self.kb_path)
+            index = self._build_index(kb_data, self.index_path)
+            snapshot = KnowledgeSnapshot(kb_data, index, self._knowledge.version + 1)
+            self._knowledge = snapshot
+        
+        # Le entry dello snapshot precedente non sono più raggiungibili
+        self.query_cache.invalidate()
+        if self.response_cache is not None:
+            self.response_cache.clear()
+        
+        print(f"✓ Knowledge base ricaricata: {len(kb_data)} documenti (v{snapshot.version})")
+        return snapshot.version
+    
+    def _mutate_knowledge(self, mutate) -> int:
+        """Applica una modifica copy-on-write all'indice e pubblica il nuovo snapshot"""
+        with self._reload_lock:
+            knowledge = self._knowledge
+            index = knowledge.index or KnowledgeIndex(knowledge.kb_data)
+            new_index = mutate(index).warm()
+            self._knowledge = KnowledgeSnapshot(
+                new_index.kb_data,
+                new_index if len(new_index) else None,
+                knowledge.version + 1
+            )
+        
+        self.query_cache.invalidate()
+        if self.response_cache is not None:
+            self.response_cache.clear()
+        return self._knowledge.version
+    
+    def add_entry(self, entry: Dict) -> int:
+        """
+        Aggiunge una voce alla KB in memoria, aggiornando l'indice in modo incrementale.
+        
+        Args:
+            entry: Voce KB {id, category, question, answer}
+        
+        Returns:
+            int: Versione dello snapshot che contiene la modifica
+        
+        Raises:
+            ValueError: Se manca l'id o l'id esiste già
+        
+        Examples:
+            >>> bot.add_entry({"id": "dining_099", "category": "dining",
+            ...                "question": "Dove mangiare la pizza?",
+            ...                "answer": "Pizzeria Da Mario, a 5 minuti dall'hotel."})
+        
+        Note:
+            Le modifiche valgono per lo snapshot in memoria: un reload dal
+            file KB (watcher) le sostituisce con il contenuto del file
+        """
+        return self._mutate_knowledge(lambda index: index.add_entry(entry))
+    
+    def update_entry(self, entry: Dict) -> int:
+        """
+        Sostituisce la voce KB con lo stesso id (vedi add_entry).
+        
+        Args:
+            entry: Nuova versione completa della voce
+        
+        Returns:
+            int: Versione dello snapshot che contiene la modifica
+        
+        Raises:
+            KeyError: Se l'id non esiste
+        """
+        return self._mutate_knowledge(lambda index: index.update_entry(entry))
+    
+    def remove_entry(self, entry_id: str) -> int:
+        """
+        Rimuove la voce KB con l'id indicato (vedi add_entry).
+        
+        Args:
+            entry_id: Id della voce
+        
+        Returns:
+            int: Versione dello snapshot che contiene la modifica
+        
+        Raises:
+            KeyError: Se l'id non esiste
+        """
+        return self._mutate_knowledge(lambda index: index.remove_entry(entry_id))
+    
+    @staticmethod
+    def _build_index(kb_data: list, index_path: Optional[str]) -> Optional[KnowledgeIndex]:
+        """Carica l'indice da disco se valido, altrimenti lo costruisce"""
+        if not kb_data:
+            return None
+        
+        index = None
+        if index_path and Path(index_path).exists():
+            try:
+                index = KnowledgeIndex.load(index_path, kb_data)
+            except Exception as e:
+                print(f"⚠️ Indice non valido, ricostruzione: {e}")
+        
+        if index is None:
+            try:
+                index = KnowledgeIndex(kb_data)
+            except Exception as e:
+                print(f"⚠️ Errore costruzione indice KB: {e}")
+                return None
+            
+            if index_path:
+                try:
+                    index.save(index_path)
+                except Exception as e:
+                    print(f"⚠️ Errore salvataggio indice KB: {e}")
+        
+        # Indice invertito e matrice documento x tag costruiti al load
+        return index.warm()
+    
     def process_guest_message(
         self,
         message: str,
-        conversation_history: List[Dict],
-        guest_info: Dict
+        conversation_history: Optional[List[Dict]] = None,
+        guest_info: Optional[Dict] = None
     ) -> str:
         """
         Elabora messaggio ospite e genera risposta appropriata.
         
         Args:
             message: Messaggio dell'ospite
-            conversation_history: Storia conversazione
+            conversation_history: Storia conversazione (opzionale).
                                   Formato: [{"role": "guest"|"bot", "content": str}, ...]
-            guest_info: Informazioni ospite
+                                  Se None viene usata la storia della sessione
+                                  tenuta dal bot, quindi basta inviare il nuovo messaggio
+            guest_info: Informazioni ospite. Senza guest_id il messaggio è
+                        gestito senza stato di sessione (niente storia,
+                        contatori di escalation né salvataggio)
                         Deve contenere: room_number, language, preferences (dict)
                         Esempio: {
                             "guest_id": "G001",
@@ -85,24 +326,54 @@ class HotelConciergeBot:
             ...     guest_info
             ... )
             >>> print(response)
+            >>> # Solo il nuovo messaggio: la storia è tenuta dal bot
+            >>> response = bot.process_guest_message(
+            ...     "E il check-out?", guest_info=guest_info
+            ... )
         
         Note:
             - Gestisce automaticamente tutti i tipi di intent
             - Salva conversazione nel database
             - Determina auto-escalation se necessario
         """
+        guest_info = guest_info or {}
         try:
             # Estrai info ospite
-            guest_id = guest_info.get('guest_id', 'UNKNOWN')
+            guest_id = guest_info.get('guest_id')
             room_number = guest_info.get('room_number', 'N/A')
             language = guest_info.get('language', 'it')
             
-            # Classify intent
-            intent, confidence = get_intent_confidence(message)
+            # Classify intent (una sola passata, risultato riusato dagli handler)
+            classification = analyze_guest_message(message)
+            intent = classification.intent
+            
+            # Nessun pattern riconosciuto = intent fallito
+            failed_intent = not any(classification.scores.values())
+            
+            # Chiamanti anonimi: nessuna sessione condivisa tra ospiti diversi
+            has_session = guest_id is not None
+            if conversation_history is None and not has_session:
+                conversation_history = []
             
             # Check escalation
-            if self.should_escalate_to_staff(conversation_history, intent):
-                return self._handle_escalation(language)
+            if conversation_history is None:
+                # Contatori della sessione, inizializzati dalla storia al primo contatto
+                if not self.escalation_tracker.has_session(guest_id):
+                    self.escalation_tracker.seed(guest_id, self.conversation_store.get_history(guest_id))
+                escalate = self.escalation_tracker.should_escalate(guest_id, intent, failed_intent)
+            else:
+                escalate = self.should_escalate_to_staff(conversation_history, intent)
+            
+            if escalate:
+                response = self._handle_escalation(language)
+                if conversation_history is None:
+                    # Lo staff prende in carico: i contatori ripartono da zero e
+                    # il turno marcato fa ripartire anche il seed dopo un riavvio
+                    self.escalation_tracker.reset(guest_id)
+                    self._save_conversation(
+                        guest_id, room_number, message, response, language, bot_role=ESCALATION_ROLE
+                    )
+                return response
             
             # Route basato su intent
             if intent == 'emergency':
@@ -112,10 +383,10 @@ class HotelConciergeBot:
                 response = self._handle_hotel_info(message, language)
             
             elif intent == 'recommendation':
-                response = self._handle_recommendation(message, guest_info, language)
+                response = self._handle_recommendation(message, guest_info, language, classification)
             
             elif intent == 'service_request':
-                response = self._handle_service_request(message, guest_info, language)
+                response = self._handle_service_request(message, guest_info, language, classification)
             
             elif intent == 'complaint':
                 response = self._handle_complaint(message, guest_info, language)
@@ -126,8 +397,11 @@ class HotelConciergeBot:
             else:
                 response = "Mi dispiace, non ho capito la richiesta. Può riformulare?" if language == 'it' else "I'm sorry, I didn't understand. Can you rephrase?"
             
-            # Salva conversazione
-            self._save_conversation(guest_id, room_number, message, response, language)
+            # Aggiorna contatori e salva conversazione
+            if has_session:
+                self.escalation_tracker.record_message(guest_id, 'guest', message, failed_intent)
+                self.escalation_tracker.record_message(guest_id, 'bot', response)
+                self._save_conversation(guest_id, room_number, message, response, language)
             
             return response
         
@@ -147,7 +421,8 @@ class HotelConciergeBot:
                 room_number=room_number,
                 request_type='concierge',
                 details=f"EMERGENZA: {message}",
-                priority='urgent'
+                priority='urgent',
+                db_path=self.db_path
             )
         except Exception as e:
             print(f"Error creating emergency request: {e}")
@@ -173,47 +448,78 @@ class HotelConciergeBot:
                 "Stay calm, help is on the way."
             )
     
+    def _search_knowledge(
+        self,
+        message: str,
+        language: str,
+        category: Optional[str] = None,
+        knowledge: Optional[KnowledgeSnapshot] = None
+    ) -> list:
+        """Ricerca KB con cache dei risultati per query ricorrenti"""
+        if knowledge is None:
+            knowledge = self._knowledge
+        
+        results = self.query_cache.get(message, category, language, knowledge.version)
+        if results is None:
+            results = search_hotel_knowledge(message, knowledge.kb_data, category=category, index=knowledge.index)
+            self.query_cache.put(message, category, language, results, knowledge.version)
+        return results
+    
     def _handle_hotel_info(self, message: str, language: str) -> str:
         """Gestisce richieste di informazioni hotel"""
+        knowledge = self._knowledge
+        
         # Search KB
-        results = search_hotel_knowledge(message, self.kb_data)
+        results = self._search_knowledge(message, language, knowledge=knowledge)
         
         # Generate response
-        response = generate_concierge_response(message, results, language)
+        response = generate_concierge_response(
+            message, results, language, self.response_cache, knowledge.version
+        )
         return response
     
-    def _handle_recommendation(self, message: str, guest_info: Dict, language: str) -> str:
+    def _handle_recommendation(
+        self,
+        message: str,
+        guest_info: Dict,
+        language: str,
+        classification: Optional[ClassificationResult] = None
+    ) -> str:
         """Gestisce richieste di raccomandazioni"""
         preferences = guest_info.get('preferences', {})
         
-        # Determina categoria dalla query
-        message_lower = message.lower()
-        if any(kw in message_lower for kw in ['ristorante', 'mangiare', 'cena', 'pranzo', 'restaurant', 'dining']):
-            category = 'dining'
-        elif any(kw in message_lower for kw in ['visitare', 'vedere', 'museo', 'attrazione', 'visit', 'see', 'museum']):
-            category = 'local_attractions'
-        elif any(kw in message_lower for kw in ['trasporto', 'taxi', 'vaporetto', 'transport']):
-            category = 'transport'
-        else:
-            category = None
+        if classification is None:
+            classification = analyze_guest_message(message)
+        
+        # Determina categoria dalle keyword già matchate in classificazione
+        category = classification.first_match(RECOMMENDATION_CATEGORY_KEYWORDS)
         
         # Search con category filter
-        results = search_hotel_knowledge(message, self.kb_data, category=category)
+        knowledge = self._knowledge
+        results = self._search_knowledge(message, language, category=category, knowledge=knowledge)
         
         # Personalizza basandosi su preferenze
-        personalized_results = self._personalize_recommendations(results, preferences)
+        personalized_results = self._personalize_recommendations(results, preferences, knowledge.index)
         
         # Generate response
-        response = generate_concierge_response(message, personalized_results, language)
+        response = generate_concierge_response(
+            message, personalized_results, language, self.response_cache, knowledge.version
+        )
         return response
     
-    def _handle_service_request(self, message: str, guest_info: Dict, language: str) -> str:
+    def _handle_service_request(
+        self,
+        message: str,
+        guest_info: Dict,
+        language: str,
+        classification: Optional[ClassificationResult] = None
+    ) -> str:
         """Gestisce richieste di servizio"""
         guest_id = guest_info.get('guest_id')
         room_number = guest_info.get('room_number')
         
         # Determina tipo servizio dal messaggio
-        request_type = self._infer_service_type(message)
+        request_type = self._infer_service_type(message, classification)
         
         try:
             # Crea richiesta
@@ -221,7 +527,8 @@ class HotelConciergeBot:
                 guest_id=guest_id,
                 room_number=room_number,
                 request_type=request_type,
-                details=message
+                details=message,
+                db_path=self.db_path
             )
             
             # Format conferma
@@ -235,22 +542,16 @@ class HotelConciergeBot:
             else:
                 return "I apologize, there was an error creating your request. Please contact reception."
     
-    def _infer_service_type(self, message: str) -> str:
-        """Determina tipo servizio dal messaggio"""
-        message_lower = message.lower()
-        
-        if any(kw in message_lower for kw in ['room service', 'servizio in camera', 'ordinare', 'order']):
-            return 'room_service'
-        elif any(kw in message_lower for kw in ['pulizie', 'housekeeping', 'pulire', 'towel', 'asciugaman']):
-            return 'housekeeping'
-        elif any(kw in message_lower for kw in ['manutenzione', 'maintenance', 'riparazione', 'repair', 'rotto']):
-            return 'maintenance'
-        elif any(kw in message_lower for kw in ['spa', 'massaggio', 'massage']):
-            return 'spa_booking'
-        elif any(kw in message_lower for kw in ['ristorante', 'restaurant', 'tavolo', 'table']):
-            return 'restaurant_booking'
-        else:
-            return 'concierge'
+    def _infer_service_type(
+        self,
+        message: str,
+        classification: Optional[ClassificationResult] = None
+    ) -> str:
+        """Determina tipo servizio dalle keyword matchate in classificazione"""
+        if classification is None:
+            classification = analyze_guest_message(message)
+        
+        return classification.first_match(SERVICE_TYPE_KEYWORDS) or 'concierge'
     
     def _handle_complaint(self, message: str, guest_info: Dict, language: str) -> str:
         """Gestisce lamentele"""
@@ -264,7 +565,8 @@ class HotelConciergeBot:
                 room_number=room_number,
                 request_type='maintenance',
                 details=f"RECLAMO: {message}",
-                priority='high'
+                priority='high',
+                db_path=self.db_path
             )
             
             if language == 'it':
@@ -291,10 +593,13 @@ class HotelConciergeBot:
     def _handle_special_request(self, message: str, guest_info: Dict, language: str) -> str:
         """Gestisce richieste speciali"""
         # Prova a cercare nella KB
-        results = search_hotel_knowledge(message, self.kb_data)
+        knowledge = self._knowledge
+        results = self._search_knowledge(message, language, knowledge=knowledge)
         
         if results and results[0].get('score', 0) > 0.3:
-            return generate_concierge_response(message, results, guest_info.get('language', 'it'))
+            return generate_concierge_response(
+                message, results, guest_info.get('language', 'it'), self.response_cache, knowledge.version
+            )
         
         # Altrimenti escalate
         if language == 'it':
@@ -350,6 +655,11 @@ class HotelConciergeBot:
             - Intent ripetuti falliti (>2 volte stesso intent)
             - Complaint ripetuto
             - VIP guest con richiesta complessa
+        
+        Note:
+            Scansione usata per le storie passate esplicitamente dal client;
+            per la storia di sessione process_guest_message usa i contatori
+            incrementali di EscalationTracker
         """
         # Emergency: no escalation immediato (messaggio automatico prima)
         if intent == 'emergency':
@@ -372,7 +682,7 @@ class HotelConciergeBot:
         # Complaint ripetuto
         complaint_count = sum(
             1 for msg in conversation_history[-4:]
-            if 'problem' in msg.get('content', '').lower() or 'lament' in msg.get('content', '').lower()
+            if SHARED_MATCHER.matches_any(msg.get('content', '').lower(), COMPLAINT_ESCALATION_KEYWORDS)
         )
         
         if complaint_count >= 2:
@@ -383,7 +693,8 @@ class HotelConciergeBot:
     def get_personalized_recommendations(
         self,
         guest_info: Dict,
-        category: str
+        category: str,
+        as_dicts: bool = False
     ) -> List[Dict]:
         """
         Raccomandazioni personalizzate basate su preferenze ospite.
@@ -391,6 +702,8 @@ class HotelConciergeBot:
         Args:
             guest_info: Info ospite con preferences
             category: Categoria ('dining', 'local_attractions', etc)
+            as_dicts: True per ricevere dict indipendenti (serializzabili e
+                      modificabili) invece di viste in sola lettura
         
         Returns:
             list: Raccomandazioni filtrate e ordinate per rilevanza
@@ -403,22 +716,56 @@ class HotelConciergeBot:
             >>> recs = bot.get_personalized_recommendations(guest, "local_attractions")
             >>> print(recs[0]['question'])
         """
-        # Get all items for category
-        category_items = [doc for doc in self.kb_data if doc.get('category') == category]
+        recommendations = self._recommendations(guest_info.get('preferences', {}), category)
+        return results_as_dicts(recommendations) if as_dicts else recommendations
+    
+    def _recommendations(self, preferences: Dict, category: str) -> list:
+        """
+        Raccomandazioni della categoria sullo snapshot corrente.
         
-        # Personalize
-        preferences = guest_info.get('preferences', {})
-        personalized = self._personalize_recommendations(category_items, preferences)
+        Restituisce sempre SearchResult (score base 0.5 più i boost), anche
+        senza preferenze: i dict della KB condivisa non escono mai.
+        """
+        knowledge = self._knowledge
+        weights = self._preference_weights(preferences or {})
+        
+        if knowledge.index is None:
+            category_items = [doc for doc in knowledge.kb_data if doc.get('category') == category]
+            return rescore_results(category_items, weights)
         
-        return personalized
+        rows = knowledge.index.category_rows.get(category)
+        if rows is None:
+            return []
+        
+        # Boost vettoriale sull'intera categoria: un prodotto matrice-vettore
+        return knowledge.index.preference_tags.rank_rows(rows, weights)
+    
+    @staticmethod
+    def _preference_weights(preferences: Dict) -> Dict[str, float]:
+        """Peso per tag del profilo: +0.2 per interesse, +0.15 per esigenza alimentare"""
+        weights: Dict[str, float] = {}
+        for interest in preferences.get('interests', []):
+            tag = interest.lower()
+            weights[tag] = weights.get(tag, 0.0) + 0.2
+        for diet in preferences.get('dietary', []):
+            tag = diet.lower()
+            weights[tag] = weights.get(tag, 0.0) + 0.15
+        return weights
     
-    def _personalize_recommendations(self, results: List[Dict], preferences: Dict) -> List[Dict]:
+    def _personalize_recommendations(
+        self,
+        results: List[Dict],
+        preferences: Dict,
+        index: Optional[KnowledgeIndex] = None
+    ) -> List[Dict]:
         """
         Personalizza raccomandazioni basandosi su preferenze.
         
         Args:
             results: Risultati da personalizzare
             preferences: Preferenze ospite (interests, dietary)
+            index: Indice dello snapshot da cui provengono i risultati: se
+                   presente il boost viene letto dalla sua matrice documento x tag
         
         Returns:
             list: Risultati riordinati per preferenze
@@ -426,32 +773,8 @@ class HotelConciergeBot:
         if not preferences or not results:
             return results
         
-        interests = preferences.get('interests', [])
-        dietary = preferences.get('dietary', [])
-        
-        # Score boost per match preferenze
-        scored_results = []
-        for result in results:
-            score = result.get('score', 0.5)
-            text = f"{result.get('question', '')} {result.get('answer', '')}".lower()
-            
-            # Boost per interests
-            for interest in interests:
-                if interest.lower() in text:
-                    score += 0.2
-            
-            # Boost per dietary
-            for diet in dietary:
-                if diet.lower() in text:
-                    score += 0.15
-            
-            result_copy = result.copy()
-            result_copy['score'] = min(score, 1.0)
-            scored_results.append(result_copy)
-        
-        # Riordina
-        scored_results.sort(key=lambda x: x.get('score', 0), reverse=True)
-        return scored_results
+        tags = index.preference_tags if index is not None else None
+        return rescore_results(results, self._preference_weights(preferences), tags)
     
     def _save_conversation(
         self,
@@ -459,35 +782,14 @@ class HotelConciergeBot:
         room_number: str,
         guest_message: str,
         bot_response: str,
-        language: str
+        language: str,
+        bot_role: str = 'bot'
     ):
-        """Salva conversazione nel database"""
+        """Aggiunge il turno alla sessione dell'ospite (write-behind se abilitato)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Semplice logging (in produzione usare conversation_id persistente)
-            messages_json = json.dumps([
-                {"role": "guest", "content": guest_message},
-                {"role": "bot", "content": bot_response}
-            ])
-            
-            # Per semplicità, crea nuova conversazione ogni volta
-            # In produzione, recuperare conversation_id esistente
-            conv_id = f"CONV-{guest_id}-{int(datetime.now().timestamp())}"
-            
-            cursor.execute("""
-                INSERT OR IGNORE INTO conversations
-                (conversation_id, guest_id, room_number, messages, language)
-                VALUES (?, ?, ?, ?, ?)
-            """, (conv_id, guest_id, room_number, messages_json, language))
-            
-            conn.commit()
-            conn.close()
-        
+            self.conversation_store.append_turn(
+                guest_id, room_number, language, guest_message, bot_response, bot_role
+            )
         except Exception as e:
             print(f"Error saving conversation: {e}")
 
-
-# Import datetime per _save_conversation
-from datetime import datetime
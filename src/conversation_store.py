@@ -0,0 +1,538 @@
+"""
+Persistenza Conversazioni
+Sessioni di conversazione append-only e scrittura write-behind dei turni
+fuori dal percorso di risposta
+"""
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from service_manager import DEFAULT_DB_PATH, get_connection_pool, initialize_database
+
+
+# Marker interni della coda del writer
+_FLUSH = object()
+_STOP = object()
+
+# Intervallo minimo tra due pulizie delle sessioni scadute in memoria
+PURGE_INTERVAL_SECONDS = 60.0
+
+
+def purge_expired_sessions(
+    sessions: Dict[str, object],
+    last_activity: Callable[[object], float],
+    ttl_seconds: float,
+    now: float
+) -> int:
+    """
+    Rimuove da una mappa guest_id -> stato le sessioni inattive oltre il TTL.
+    
+    Args:
+        sessions: Mappa delle sessioni in memoria (modificata sul posto)
+        last_activity: Estrae il timestamp monotonic dell'ultima attività
+        ttl_seconds: Inattività oltre la quale la sessione è scaduta
+        now: Timestamp monotonic corrente
+    
+    Returns:
+        int: Numero di sessioni rimosse
+    
+    Note:
+        Condiviso da ConversationStore ed EscalationTracker; il chiamante
+        tiene il proprio lock
+    """
+    expired = [
+        guest_id for guest_id, state in sessions.items()
+        if now - last_activity(state) > ttl_seconds
+    ]
+    for guest_id in expired:
+        del sessions[guest_id]
+    return len(expired)
+
+
+def write_conversation_turns(conn: sqlite3.Connection, turns: List[Dict]):
+    """
+    Scrive un batch di turni in un'unica transazione.
+    
+    Args:
+        conn: Connessione al database
+        turns: Lista di dizionari con chiavi conversation_id, guest_id,
+               room_number, language, is_new (True al primo turno della
+               sessione) e messages (lista di {role, content})
+    
+    Note:
+        Il numero di sequenza è assegnato dal database (MAX(seq) + 1 sulla
+        chiave primaria), quindi scritture concorrenti sulla stessa
+        conversazione non collidono e nessun turno viene scartato
+    """
+    try:
+        conn.executemany("""
+            INSERT OR IGNORE INTO conversations
+            (conversation_id, guest_id, room_number, language)
+            VALUES (:conversation_id, :guest_id, :room_number, :language)
+        """, [turn for turn in turns if turn.get('is_new')])
+        
+        conn.executemany("""
+            INSERT INTO conversation_messages (conversation_id, seq, role, content)
+            SELECT :conversation_id, COALESCE(MAX(seq), -1) + 1, :role, :content
+            FROM conversation_messages
+            WHERE conversation_id = :conversation_id
+        """, [
+            {'conversation_id': turn['conversation_id'], 'role': msg['role'], 'content': msg['content']}
+            for turn in turns
+            for msg in turn['messages']
+        ])
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+
+class ConversationStore:
+    """
+    Sessioni di conversazione persistenti per ospite.
+    
+    Ogni ospite ha un conversation_id stabile per tutta la sessione; i turni
+    vengono aggiunti a conversation_messages con numeri di sequenza
+    progressivi, quindi nessun turno viene perso anche se arrivano nello
+    stesso secondo. Per ogni sessione viene tenuto in memoria un ring buffer
+    con gli ultimi history_size messaggi, caricato dal database al primo
+    contatto dell'ospite (es. dopo un riavvio).
+    
+    Examples:
+        >>> store = ConversationStore("data/hotel_database.sqlite")
+        >>> conv_id = store.append_turn("G001", "305", "it", "Ciao", "Benvenuto!")
+        >>> [m['role'] for m in store.get_messages(conv_id)]
+        ['guest', 'bot']
+        >>> store.get_history("G001")[-1]['content']
+        'Benvenuto!'
+    
+    Note:
+        - La sessione scade dopo session_ttl_seconds di inattività: il turno
+          successivo apre una nuova conversazione
+        - Al primo contatto viene ripresa l'ultima conversazione dell'ospite
+          nel database, se la sua attività è più recente del TTL
+        - Le sessioni scadute vengono rimosse dalla memoria durante gli
+          accessi (al massimo una pulizia al minuto) o con purge_expired()
+    """
+    
+    def __init__(
+        self,
+        db_path: str = DEFAULT_DB_PATH,
+        writer: Optional['ConversationWriter'] = None,
+        session_ttl_seconds: float = 4 * 3600,
+        history_size: int = 20
+    ):
+        """
+        Args:
+            db_path: Path al database SQLite
+            writer: ConversationWriter per la scrittura write-behind
+                    (None = scrittura sincrona)
+            session_ttl_seconds: Inattività massima prima di aprire una nuova sessione
+            history_size: Messaggi tenuti in memoria per sessione (ring buffer)
+        """
+        self.db_path = db_path
+        self.writer = writer
+        self.session_ttl_seconds = session_ttl_seconds
+        self.history_size = history_size
+        self._sessions: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._next_purge = time.monotonic() + PURGE_INTERVAL_SECONDS
+    
+    def _new_session(self, guest_id: str, now: float) -> Dict:
+        return {
+            'conversation_id': f"CONV-{guest_id}-{uuid.uuid4().hex[:8].upper()}",
+            'persisted': False,
+            'history': deque(maxlen=self.history_size),
+            'last_activity': now
+        }
+    
+    def _load_session(self, guest_id: str, now: float) -> Optional[Dict]:
+        """Riprende dal database l'ultima conversazione non scaduta dell'ospite"""
+        initialize_database(self.db_path)
+        conn = get_connection_pool(self.db_path).get_connection()
+        row = conn.execute("""
+            SELECT c.conversation_id,
+                   (julianday('now') - julianday(MAX(m.created_at))) * 86400 AS idle_seconds
+            FROM (SELECT conversation_id FROM conversations
+                  WHERE guest_id = ?
+                  ORDER BY created_at DESC, rowid DESC
+                  LIMIT 1) AS c
+            JOIN conversation_messages m ON m.conversation_id = c.conversation_id
+            GROUP BY c.conversation_id
+        """, (guest_id,)).fetchone()
+        
+        if row is None or row['idle_seconds'] > self.session_ttl_seconds:
+            return None
+        
+        recent = conn.execute("""
+            SELECT role, content FROM conversation_messages
+            WHERE conversation_id = ?
+            ORDER BY seq DESC
+            LIMIT ?
+        """, (row['conversation_id'], self.history_size)).fetchall()
+        
+        return {
+            'conversation_id': row['conversation_id'],
+            'persisted': True,
+            'history': deque(
+                ({'role': r['role'], 'content': r['content']} for r in reversed(recent)),
+                maxlen=self.history_size
+            ),
+            'last_activity': now - max(row['idle_seconds'], 0.0)
+        }
+    
+    def _ensure_loaded(self, guest_id: str):
+        """
+        Al primo contatto in questo processo carica la sessione dal database.
+        
+        Flush del writer e query girano fuori da _lock, così il primo
+        messaggio di un ospite non blocca le sessioni degli altri; la
+        sessione viene installata con un double-check sotto lock.
+        """
+        with self._lock:
+            if guest_id in self._sessions:
+                return
+        
+        if self.writer is not None:
+            self.writer.flush()
+        loaded = self._load_session(guest_id, time.monotonic())
+        
+        with self._lock:
+            if guest_id not in self._sessions:
+                self._sessions[guest_id] = loaded or self._new_session(guest_id, time.monotonic())
+    
+    def _session(self, guest_id: str, now: float) -> Dict:
+        """Sessione attiva dell'ospite (nuova se assente o scaduta). Chiamare con _lock"""
+        if now >= self._next_purge:
+            self._purge_expired(now)
+        
+        session = self._sessions.get(guest_id)
+        if session is None or now - session['last_activity'] > self.session_ttl_seconds:
+            session = self._new_session(guest_id, now)
+            self._sessions[guest_id] = session
+        return session
+    
+    def _purge_expired(self, now: float) -> int:
+        """Rimuove le sessioni scadute. Chiamare con _lock"""
+        self._next_purge = now + PURGE_INTERVAL_SECONDS
+        return purge_expired_sessions(
+            self._sessions, lambda session: session['last_activity'],
+            self.session_ttl_seconds, now
+        )
+    
+    def purge_expired(self) -> int:
+        """
+        Rimuove dalla memoria le sessioni scadute.
+        
+        Returns:
+            int: Numero di sessioni rimosse
+        """
+        with self._lock:
+            return self._purge_expired(time.monotonic())
+    
+    def get_conversation_id(self, guest_id: str) -> Optional[str]:
+        """Conversation id della sessione attiva dell'ospite (None se assente o scaduta)"""
+        with self._lock:
+            session = self._sessions.get(guest_id)
+            if session is None:
+                return None
+            if time.monotonic() - session['last_activity'] > self.session_ttl_seconds:
+                return None
+            return session['conversation_id']
+    
+    def get_history(self, guest_id: str) -> List[Dict]:
+        """
+        Ultimi messaggi della sessione dell'ospite, senza query al database
+        dopo il primo contatto.
+        
+        Args:
+            guest_id: ID ospite
+        
+        Returns:
+            List[Dict]: Fino a history_size messaggi {role, content}, dal più vecchio
+        """
+        self._ensure_loaded(guest_id)
+        with self._lock:
+            return list(self._session(guest_id, time.monotonic())['history'])
+    
+    def append_turn(
+        self,
+        guest_id: str,
+        room_number: str,
+        language: str,
+        guest_message: str,
+        bot_response: str,
+        bot_role: str = 'bot'
+    ) -> str:
+        """
+        Aggiunge un turno (messaggio ospite + risposta bot) alla sessione.
+        
+        Args:
+            guest_id: ID ospite
+            room_number: Numero camera
+            language: Lingua della conversazione
+            guest_message: Messaggio dell'ospite
+            bot_response: Risposta del bot
+            bot_role: Ruolo salvato per la risposta (es. 'escalation')
+        
+        Returns:
+            str: conversation_id della sessione
+        """
+        messages = [
+            {'role': 'guest', 'content': guest_message},
+            {'role': bot_role, 'content': bot_response}
+        ]
+        
+        self._ensure_loaded(guest_id)
+        with self._lock:
+            now = time.monotonic()
+            session = self._session(guest_id, now)
+            session['history'].extend(messages)
+            session['last_activity'] = now
+            is_new = not session['persisted']
+            session['persisted'] = True
+            conversation_id = session['conversation_id']
+        
+        turn = {
+            'conversation_id': conversation_id,
+            'guest_id': guest_id,
+            'room_number': room_number,
+            'language': language,
+            'is_new': is_new,
+            'messages': messages
+        }
+        
+        if self.writer is not None:
+            self.writer.submit(turn)
+        else:
+            initialize_database(self.db_path)
+            write_conversation_turns(get_connection_pool(self.db_path).get_connection(), [turn])
+        
+        return conversation_id
+    
+    def get_messages(self, conversation_id: str) -> List[Dict]:
+        """
+        Storia di una conversazione in ordine di sequenza.
+        
+        Args:
+            conversation_id: ID conversazione
+        
+        Returns:
+            List[Dict]: Messaggi con chiavi seq, role, content, created_at
+        """
+        if self.writer is not None:
+            self.writer.flush()
+        
+        conn = get_connection_pool(self.db_path).get_connection()
+        rows = conn.execute("""
+            SELECT seq, role, content, created_at FROM conversation_messages
+            WHERE conversation_id = ?
+            ORDER BY seq
+        """, (conversation_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+
+class ConversationWriter:
+    """
+    Writer in background con coda limitata per il logging delle conversazioni.
+    
+    I turni vengono accodati senza toccare il database; un thread dedicato
+    li scrive in transazioni batch quando il batch è pieno o è trascorso
+    flush_interval, togliendo la latenza di fsync dal percorso dell'ospite.
+    
+    Examples:
+        >>> writer = ConversationWriter("data/hotel_database.sqlite")
+        >>> writer.submit({"conversation_id": "CONV-G001-1", "guest_id": "G001",
+        ...                "room_number": "305", "language": "it", "is_new": True,
+        ...                "messages": [{"role": "guest", "content": "Ciao"}]})
+        >>> writer.flush()
+        >>> writer.close()
+    
+    Note:
+        - Backpressure: se la coda è piena submit() attende fino a put_timeout,
+          poi scrive in modo sincrono nel thread chiamante (nessun turno perso)
+        - close() (registrato anche con atexit fino alla chiusura) svuota la
+          coda prima di uscire
+        - Il thread parte alla prima submit()
+    """
+    
+    def __init__(
+        self,
+        db_path: str = DEFAULT_DB_PATH,
+        batch_size: int = 50,
+        flush_interval: float = 0.5,
+        max_queue: int = 1000,
+        put_timeout: float = 0.05
+    ):
+        """
+        Args:
+            db_path: Path al database SQLite
+            batch_size: Numero massimo di turni per transazione
+            flush_interval: Attesa massima (secondi) prima di scrivere un batch parziale
+            max_queue: Capacità della coda
+            put_timeout: Attesa massima di submit() con coda piena
+        """
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._closed = False
+        # submit() in corso: close() attende che abbiano accodato prima di fermare il thread
+        self._submit_cond = threading.Condition()
+        self._inflight = 0
+        
+        self.written = 0
+        self.batches = 0
+        self.sync_writes = 0
+        self.errors = 0
+        
+        atexit.register(self.close)
+    
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="conversation-writer", daemon=True
+                )
+                self._thread.start()
+    
+    def submit(self, turn: Dict):
+        """
+        Accoda un turno di conversazione.
+        
+        Args:
+            turn: Record da scrivere (vedi write_conversation_turns)
+        """
+        with self._submit_cond:
+            closed = self._closed
+            if not closed:
+                self._inflight += 1
+        if closed:
+            self._write_sync([turn])
+            return
+        
+        try:
+            self._ensure_started()
+            try:
+                self._queue.put(turn, timeout=self.put_timeout)
+            except queue.Full:
+                # Backpressure: il chiamante paga la scrittura, nessun turno perso
+                self._write_sync([turn])
+        finally:
+            with self._submit_cond:
+                self._inflight -= 1
+                if not self._inflight:
+                    self._submit_cond.notify_all()
+    
+    def flush(self):
+        """Attende che tutti i turni accodati siano scritti"""
+        if self._thread is None or self._closed:
+            return
+        self._queue.put(_FLUSH)
+        self._queue.join()
+    
+    def close(self):
+        """Scrive i turni pendenti e ferma il thread (idempotente)"""
+        with self._submit_cond:
+            if self._closed:
+                return
+            self._closed = True
+            # Le submit() già entrate finiscono di accodare prima dello stop
+            self._submit_cond.wait_for(lambda: self._inflight == 0)
+        atexit.unregister(self.close)
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+    
+    def stats(self) -> Dict[str, int]:
+        """Contatori di scrittura e profondità della coda"""
+        with self._stats_lock:
+            return {
+                'written': self.written,
+                'batches': self.batches,
+                'sync_writes': self.sync_writes,
+                'errors': self.errors,
+                'queued': self._queue.qsize()
+            }
+    
+    def _write_sync(self, turns: List[Dict]):
+        with self._stats_lock:
+            self.sync_writes += len(turns)
+        self._write(turns)
+    
+    def _write(self, turns: List[Dict]):
+        try:
+            initialize_database(self.db_path)
+            conn = get_connection_pool(self.db_path).get_connection()
+            write_conversation_turns(conn, turns)
+            with self._stats_lock:
+                self.written += len(turns)
+                self.batches += 1
+        except Exception as e:
+            if len(turns) > 1:
+                # Un turno difettoso non deve far perdere l'intero batch
+                for turn in turns:
+                    self._write([turn])
+                return
+            with self._stats_lock:
+                self.errors += 1
+            print(f"Error saving conversation batch: {e}")
+    
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            received = 1
+            batch = []
+            
+            if item is _STOP:
+                stopping = True
+            elif item is not _FLUSH:
+                batch.append(item)
+                
+                # Raccogli fino a batch_size o fino a flush_interval
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    received += 1
+                    if item is _FLUSH:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+            
+            if stopping:
+                # Svuota quanto resta in coda prima di uscire
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    received += 1
+                    if item is not _FLUSH and item is not _STOP:
+                        batch.append(item)
+            
+            if batch:
+                self._write(batch)
+            
+            for _ in range(received):
+                self._queue.task_done()
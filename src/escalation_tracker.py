@@ -0,0 +1,240 @@
+"""
+Tracking Escalation per Sessione
+Contatori incrementali per ospite al posto della scansione della storia
+"""
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+from conversation_store import PURGE_INTERVAL_SECONDS, purge_expired_sessions
+from keyword_matcher import SHARED_MATCHER, COMPLAINT_ESCALATION_KEYWORDS, KeywordMatcher
+
+
+# Ruolo della risposta di escalation salvata nella storia: i contatori
+# ripartono dal messaggio successivo
+ESCALATION_ROLE = 'escalation'
+
+
+class _SessionCounters:
+    """Stato di escalation di una sessione (finestre scorrevoli con somme correnti)"""
+    
+    __slots__ = (
+        'messages', 'recent_roles', 'recent_guest', 'recent_complaints',
+        'complaint_hits', 'failed_intents', 'last_activity'
+    )
+    
+    def __init__(self, recent_window: int, complaint_window: int, now: float):
+        self.messages = 0
+        self.recent_roles = deque(maxlen=recent_window)
+        self.recent_guest = 0
+        self.recent_complaints = deque(maxlen=complaint_window)
+        self.complaint_hits = 0
+        self.failed_intents = 0
+        self.last_activity = now
+
+
+class EscalationTracker:
+    """
+    Contatori di escalation per sessione, aggiornati in O(1) a ogni messaggio.
+    
+    Applica le stesse regole di HotelConciergeBot.should_escalate_to_staff
+    (troppi messaggi, molte domande ravvicinate, lamentele ripetute) senza
+    riscandire né rifare lower() della storia a ogni turno, più la regola
+    sugli intent falliti ripetuti (messaggi senza alcun pattern riconosciuto).
+    
+    Examples:
+        >>> tracker = EscalationTracker(max_complaints=2)
+        >>> tracker.record_message("G001", "guest", "Ho un problema")
+        >>> tracker.record_message("G001", "guest", "Ancora il problema")
+        >>> tracker.should_escalate("G001", "complaint")
+        True
+    
+    Note:
+        - Le sessioni inattive da più di session_ttl_seconds ripartono da zero
+          e vengono rimosse durante gli aggiornamenti (al massimo una pulizia
+          al minuto) o con purge_expired()
+        - Dopo un'escalation il chiamante azzera i contatori con reset(), così
+          la sessione non resta bloccata in escalation
+        - Thread-safe: un lock protegge la mappa delle sessioni
+    """
+    
+    def __init__(
+        self,
+        max_messages: int = 10,
+        recent_window: int = 6,
+        max_recent_guest: int = 3,
+        complaint_window: int = 4,
+        max_complaints: int = 2,
+        max_failed_intents: int = 2,
+        session_ttl_seconds: float = 4 * 3600,
+        complaint_keywords: Iterable[str] = COMPLAINT_ESCALATION_KEYWORDS,
+        matcher: KeywordMatcher = SHARED_MATCHER
+    ):
+        """
+        Args:
+            max_messages: Escalation oltre questo numero di messaggi nella sessione
+            recent_window: Ultimi messaggi considerati per le domande ravvicinate
+            max_recent_guest: Escalation oltre questo numero di messaggi ospite nella finestra
+            complaint_window: Ultimi messaggi considerati per le lamentele
+            max_complaints: Escalation da questo numero di lamentele nella finestra
+            max_failed_intents: Escalation oltre questo numero di intent falliti consecutivi
+            session_ttl_seconds: Inattività dopo cui i contatori vengono azzerati
+            complaint_keywords: Keyword che segnalano una lamentela
+            matcher: KeywordMatcher che contiene complaint_keywords
+        """
+        self.max_messages = max_messages
+        self.recent_window = recent_window
+        self.max_recent_guest = max_recent_guest
+        self.complaint_window = complaint_window
+        self.max_complaints = max_complaints
+        self.max_failed_intents = max_failed_intents
+        self.session_ttl_seconds = session_ttl_seconds
+        self.complaint_keywords = tuple(complaint_keywords)
+        self.matcher = matcher
+        
+        self._sessions: Dict[str, _SessionCounters] = {}
+        self._lock = threading.Lock()
+        self._next_purge = time.monotonic() + PURGE_INTERVAL_SECONDS
+    
+    def _active(self, guest_id: str, now: float) -> Optional[_SessionCounters]:
+        """Contatori della sessione, None se assente o scaduta. Chiamare con _lock"""
+        counters = self._sessions.get(guest_id)
+        if counters is not None and now - counters.last_activity > self.session_ttl_seconds:
+            del self._sessions[guest_id]
+            return None
+        return counters
+    
+    def has_session(self, guest_id: str) -> bool:
+        """True se l'ospite ha una sessione attiva"""
+        with self._lock:
+            return self._active(guest_id, time.monotonic()) is not None
+    
+    def seed(self, guest_id: str, history: List[Dict]):
+        """
+        Inizializza i contatori da una storia esistente (es. caricata dal database).
+        
+        Args:
+            guest_id: ID ospite
+            history: Messaggi [{"role": ..., "content": ...}, ...] dal più vecchio
+        
+        Note:
+            Vengono contati solo i messaggi successivi all'ultima escalation
+            (messaggio con ruolo ESCALATION_ROLE)
+        """
+        start = 0
+        for i, msg in enumerate(history):
+            if msg.get('role') == ESCALATION_ROLE:
+                start = i + 1
+        
+        with self._lock:
+            now = time.monotonic()
+            counters = _SessionCounters(self.recent_window, self.complaint_window, now)
+            self._sessions[guest_id] = counters
+            for msg in history[start:]:
+                self._update(counters, msg.get('role'), msg.get('content', ''))
+    
+    def record_message(
+        self,
+        guest_id: str,
+        role: str,
+        content: str,
+        failed_intent: Optional[bool] = None
+    ):
+        """
+        Aggiorna i contatori con un nuovo messaggio.
+        
+        Args:
+            guest_id: ID ospite
+            role: 'guest' o 'bot'
+            content: Testo del messaggio
+            failed_intent: Per i messaggi ospite, True se nessun intent è stato
+                           riconosciuto (None = non valutato)
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._next_purge:
+                self._purge_expired(now)
+            
+            counters = self._active(guest_id, now)
+            if counters is None:
+                counters = _SessionCounters(self.recent_window, self.complaint_window, now)
+                self._sessions[guest_id] = counters
+            
+            self._update(counters, role, content)
+            if failed_intent is not None:
+                counters.failed_intents = counters.failed_intents + 1 if failed_intent else 0
+            counters.last_activity = now
+    
+    def _update(self, counters: _SessionCounters, role: Optional[str], content: str):
+        counters.messages += 1
+        
+        is_guest = role == 'guest'
+        if len(counters.recent_roles) == counters.recent_roles.maxlen:
+            counters.recent_guest -= counters.recent_roles[0]
+        counters.recent_roles.append(is_guest)
+        counters.recent_guest += is_guest
+        
+        is_complaint = self.matcher.matches_any(content.lower(), self.complaint_keywords)
+        if len(counters.recent_complaints) == counters.recent_complaints.maxlen:
+            counters.complaint_hits -= counters.recent_complaints[0]
+        counters.recent_complaints.append(is_complaint)
+        counters.complaint_hits += is_complaint
+    
+    def should_escalate(self, guest_id: str, intent: str, failed_intent: bool = False) -> bool:
+        """
+        Determina se escalare la sessione a staff umano.
+        
+        Args:
+            guest_id: ID ospite
+            intent: Intent del messaggio corrente
+            failed_intent: True se il messaggio corrente non ha riconosciuto alcun intent
+        
+        Returns:
+            bool: True se necessita escalation
+        """
+        # Emergency: gestita con alert automatico
+        if intent == 'emergency':
+            return False
+        
+        with self._lock:
+            counters = self._active(guest_id, time.monotonic())
+            if counters is None:
+                return False
+            
+            return (
+                counters.messages > self.max_messages
+                or counters.recent_guest > self.max_recent_guest
+                or counters.complaint_hits >= self.max_complaints
+                or counters.failed_intents + failed_intent > self.max_failed_intents
+            )
+    
+    def reset(self, guest_id: str):
+        """
+        Azzera i contatori dell'ospite (es. dopo un'escalation allo staff).
+        
+        La sessione resta attiva con contatori vuoti, quindi non viene
+        reinizializzata dalla storia al messaggio successivo.
+        """
+        with self._lock:
+            self._sessions[guest_id] = _SessionCounters(
+                self.recent_window, self.complaint_window, time.monotonic()
+            )
+    
+    def purge_expired(self) -> int:
+        """
+        Rimuove le sessioni scadute.
+        
+        Returns:
+            int: Numero di sessioni rimosse
+        """
+        with self._lock:
+            return self._purge_expired(time.monotonic())
+    
+    def _purge_expired(self, now: float) -> int:
+        """Rimuove le sessioni scadute. Chiamare con _lock"""
+        self._next_purge = now + PURGE_INTERVAL_SECONDS
+        return purge_expired_sessions(
+            self._sessions, lambda counters: counters.last_activity,
+            self.session_ttl_seconds, now
+        )
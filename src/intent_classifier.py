@@ -3,11 +3,257 @@ Sistema di Routing Intelligente per Hotel Concierge Bot
 Classifica gli intent degli ospiti usando pattern matching e keywords
 """
 import re
-from typing import Literal
+from typing import Dict, FrozenSet, List, Literal, NamedTuple, Optional, Tuple
+
+from keyword_matcher import (
+    KeywordMatcher, SHARED_MATCHER,
+    RECOMMENDATION_CATEGORY_KEYWORDS, SERVICE_TYPE_KEYWORDS
+)
 
 Intent = Literal['hotel_info', 'service_request', 'recommendation', 'special_request', 'complaint', 'emergency']
 
 
+# Pattern per intent, nell'ordine storico. Ogni voce è il corpo di una regex
+# \b(...)\b; i pattern vengono compilati una volta sola in IntentClassifier
+INTENT_PATTERNS = {
+    # Priority 1: EMERGENCY - Situazioni urgenti
+    'emergency': [
+        r'emergenza|emergency|aiuto|help|urgente|urgent',
+        r'incendio|fire|fuoco',
+        r'furto|rub|stolen|theft',
+        r'malato|sick|infortunio|injured|ambulanza|ambulance',
+        r'pericolo|danger|attacco|attack'
+    ],
+    # Priority 2: COMPLAINT - Lamentele e problemi
+    'complaint': [
+        r'lament|complaint|reclamo|problem',
+        r'non funziona|not working|rotto|broken|guasto',
+        r'sporca|sporco|dirty|pulito male|not clean',
+        r'rumore|noise|rumoros',
+        r'freddo|caldo|troppo|too hot|too cold',
+        r'insoddisfatt|unsatisfied|delus|disappointed',
+        r'pessim|terribil|awful|terrible'
+    ],
+    # Priority 3: SERVICE REQUEST - Richieste di servizio
+    'service_request': [
+        r'vorrei|would like|desidero|wish|voglio|want',
+        r'room service|servizio in camera|order|ordinare',
+        r'pulizie|housekeeping|pulire|clean|towel|asciugaman',
+        r'manutenzione|maintenance|riparazione|repair',
+        r'prenotare|prenota|book|reservation|reserve',
+        r'spa|massaggio|massage',
+        r'transfer|taxi|trasporto',
+        r'chiamare|call|contattare|contact',
+        r'ho bisogno|need|necessito'
+    ],
+    # Priority 4: RECOMMENDATION - Consigli e raccomandazioni
+    'recommendation': [
+        r'consiglio|consiglia|recommend|suggest|sugger',
+        r'ristorante|restaurant|mangiare|eat|cena|dinner|pranzo|lunch',
+        r'visitare|visit|vedere|see|cosa fare|what to do',
+        r'attrazione|attraction|museo|museum|monumento',
+        r'dove|where|come arriv|how to get',
+        r'shopping|negozi|shop',
+        r'migliore|best|top'
+    ],
+    # Priority 5: HOTEL INFO - Informazioni sull'hotel
+    'hotel_info': [
+        r'a che ora|at what time|che ora|orario|orari|hour',
+        r'quali sono|what are',
+        r'c\'è|ci sono|is there|are there|have you|avete',
+        r'informazione|information|info',
+        r'check.?in|check.?out',
+        r'wifi|internet|password',
+        r'(?:colazione|breakfast)\b(?!.*\b(?:prenota|order|vorrei))',
+        r'parcheggio|parking',
+        r'quanto cost|how much|prezzo|price'
+    ]
+}
+
+# Keyword che alzano la confidenza dell'intent rilevato
+CONFIDENCE_PATTERNS = {
+    'emergency': r'emergenza|emergency|aiuto|urgente',
+    'complaint': r'lament|problem|non funziona|sporco|rumore',
+    'service_request': r'vorrei|room service|prenotare|spa|transfer',
+    'recommendation': r'consiglio|ristorante|visitare|dove',
+    'hotel_info': r'orario|c\'è|check.?in|wifi|colazione'
+}
+
+class ClassificationResult(NamedTuple):
+    """
+    Risultato completo della classificazione, calcolato una volta per messaggio.
+    
+    Attributes:
+        intent: Intent classificato
+        confidence: Confidenza tra 0.0 e 1.0
+        scores: Numero di pattern matchati per intent
+        matched_keywords: Keyword trovate nel messaggio (pattern di intent e
+                          vocabolari del KeywordMatcher condiviso), riusabili
+                          dagli handler
+    """
+    intent: Intent
+    confidence: float
+    scores: Dict[str, int]
+    matched_keywords: FrozenSet[str]
+    
+    def first_match(self, vocabulary: Dict[str, List[str]]) -> Optional[str]:
+        """Prima voce del vocabolario con almeno una keyword nel messaggio"""
+        for label, keywords in vocabulary.items():
+            if any(kw in self.matched_keywords for kw in keywords):
+                return label
+        return None
+
+
+# Keyword registrate anche quando non contano per lo score
+# (es. 'colazione' seguita da una richiesta di prenotazione)
+_PLAIN_KEYWORDS = r'colazione'
+
+
+class IntentClassifier:
+    """
+    Classificatore di intent pre-compilato a passata singola.
+    
+    Tutti i pattern vengono compilati all'import in un'unica regex con un
+    gruppo nominato per pattern, valutata in lookahead ad ogni inizio parola:
+    una sola scansione del messaggio produce gli score di tutti gli intent
+    e la confidenza, con le stesse regole di priorità della versione storica.
+    
+    Examples:
+        >>> classifier = IntentClassifier()
+        >>> classifier.classify("A che ora è la colazione?")
+        ('hotel_info', 0.7)
+    
+    Note:
+        Gli alternativi di pattern diversi non possono iniziare nella stessa
+        posizione, quindi il primo gruppo che matcha è l'unico possibile
+    """
+    
+    def __init__(
+        self,
+        intent_patterns: Dict[str, List[str]] = INTENT_PATTERNS,
+        confidence_patterns: Dict[str, str] = CONFIDENCE_PATTERNS,
+        keyword_matcher: KeywordMatcher = SHARED_MATCHER
+    ):
+        self._group_owner: Dict[str, Tuple[str, int]] = {}
+        branches = []
+        for intent, patterns in intent_patterns.items():
+            for idx, pattern in enumerate(patterns):
+                name = f"{intent}_{idx}"
+                self._group_owner[name] = (intent, idx)
+                branches.append(f"(?P<{name}>(?:{pattern})\\b)")
+        branches.append(f"(?P<plain>(?:{_PLAIN_KEYWORDS})\\b)")
+        
+        self._scanner = re.compile(
+            r'\b(?=' + '|'.join(branches) + ')',
+            re.IGNORECASE
+        )
+        self._confidence = {
+            intent: re.compile(rf'(?:{pattern})\b', re.IGNORECASE)
+            for intent, pattern in confidence_patterns.items()
+        }
+        self._intents = list(intent_patterns)
+        
+        # Automa Aho-Corasick condiviso per i vocabolari di routing/priorità
+        self._keyword_matcher = keyword_matcher
+    
+    def _scan(self, message_lower: str) -> Tuple[Dict[str, int], Dict[str, List[str]]]:
+        """Singola passata: pattern distinti matchati e keyword per intent"""
+        matched_patterns = {intent: set() for intent in self._intents}
+        keywords = {intent: [] for intent in self._intents}
+        
+        for match in self._scanner.finditer(message_lower):
+            name = match.lastgroup
+            text = match.group(name)
+            if name == 'plain':
+                keywords['hotel_info'].append(text)
+                continue
+            intent, idx = self._group_owner[name]
+            matched_patterns[intent].add(idx)
+            keywords[intent].append(text)
+        
+        scores = {intent: len(found) for intent, found in matched_patterns.items()}
+        return scores, keywords
+    
+    def analyze(self, guest_message: str) -> ClassificationResult:
+        """
+        Classifica il messaggio producendo intent, confidenza, score e keyword.
+        
+        Args:
+            guest_message: Messaggio dell'ospite
+        
+        Returns:
+            ClassificationResult: Risultato riusabile da tutti gli handler
+        """
+        if not guest_message or not isinstance(guest_message, str):
+            empty_scores = {intent: 0 for intent in self._intents}
+            return ClassificationResult('special_request', 0.3, empty_scores, frozenset())
+        
+        message_lower = guest_message.lower()
+        scores, keywords = self._scan(message_lower)
+        intent = self._decide(scores, message_lower)
+        
+        if intent in self._confidence:
+            pattern = self._confidence[intent]
+            matches = 1 if any(pattern.fullmatch(kw) for kw in keywords[intent]) else 0
+            confidence = min(0.5 + (matches * 0.2), 1.0)
+        else:
+            confidence = 0.3  # special_request ha confidenza bassa
+        
+        matched_keywords = self._keyword_matcher.find(message_lower).union(
+            kw for found in keywords.values() for kw in found
+        )
+        return ClassificationResult(intent, confidence, scores, matched_keywords)
+    
+    def classify(self, guest_message: str) -> Tuple[Intent, float]:
+        """
+        Classifica il messaggio e calcola la confidenza in una sola passata.
+        
+        Args:
+            guest_message: Messaggio dell'ospite
+        
+        Returns:
+            tuple: (intent, confidence_score) come get_intent_confidence
+        """
+        result = self.analyze(guest_message)
+        return result.intent, result.confidence
+    
+    @staticmethod
+    def _decide(scores: Dict[str, int], message_lower: str) -> Intent:
+        """Decision logic basata su score con priorità"""
+        if scores['emergency'] > 0:
+            return 'emergency'
+        
+        complaint_score = scores['complaint']
+        service_score = scores['service_request']
+        recommendation_score = scores['recommendation']
+        info_score = scores['hotel_info']
+        
+        max_score = max(complaint_score, service_score, recommendation_score, info_score)
+        
+        # Se nessun match, è special_request
+        if max_score == 0:
+            return 'special_request'
+        
+        # Priorità in caso di parità: complaint > service > recommendation > info
+        if complaint_score >= max_score:
+            return 'complaint'
+        elif service_score >= max_score:
+            # Check se non è più probabile hotel_info per domande tipo "A che ora..."
+            if info_score > 0 and 'quando' in message_lower or 'che ora' in message_lower or 'orario' in message_lower or 'quali sono' in message_lower:
+                if 'prenota' not in message_lower and 'vorrei' not in message_lower and 'posso' not in message_lower:
+                    return 'hotel_info'
+            return 'service_request'
+        elif recommendation_score >= max_score:
+            return 'recommendation'
+        elif info_score >= max_score:
+            return 'hotel_info'
+        else:
+            return 'special_request'
+
+
+_CLASSIFIER = IntentClassifier()
+
+
 def classify_guest_intent(guest_message: str) -> Intent:
     """
     Classifica l'intent dell'ospite analizzando il messaggio.
@@ -41,110 +287,27 @@ def classify_guest_intent(guest_message: str) -> Intent:
         5. Hotel Info
         6. Special Request (fallback)
     """
-    if not guest_message or not isinstance(guest_message, str):
-        return 'special_request'
-    
-    message_lower = guest_message.lower()
-    
-    # Priority 1: EMERGENCY - Situazioni urgenti
-    emergency_patterns = [
-        r'\b(emergenza|emergency|aiuto|help|urgente|urgent)\b',
-        r'\b(incendio|fire|fuoco)\b',
-        r'\b(furto|rub|stolen|theft)\b',
-        r'\b(malato|sick|infortunio|injured|ambulanza|ambulance)\b',
-        r'\b(pericolo|danger|attacco|attack)\b'
-    ]
-    
-    for pattern in emergency_patterns:
-        if re.search(pattern, message_lower, re.IGNORECASE):
-            return 'emergency'
-    
-    # Priority 2: COMPLAINT - Lamentele e problemi
-    complaint_patterns = [
-        r'\b(lament|complaint|reclamo|problem)\b',
-        r'\b(non funziona|not working|rotto|broken|guasto)\b',
-        r'\b(sporca|sporco|dirty|pulito male|not clean)\b',
-        r'\b(rumore|noise|rumoros)\b',
-        r'\b(freddo|caldo|troppo|too hot|too cold)\b',
-        r'\b(insoddisfatt|unsatisfied|delus|disappointed)\b',
-        r'\b(pessim|terribil|awful|terrible)\b'
-    ]
-    
-    complaint_score = sum(1 for p in complaint_patterns if re.search(p, message_lower, re.IGNORECASE))
-    
-    # Priority 3: SERVICE REQUEST - Richieste di servizio
-    service_patterns = [
-        r'\b(vorrei|would like|desidero|wish|voglio|want)\b',
-        r'\b(room service|servizio in camera|order|ordinare)\b',
-        r'\b(pulizie|housekeeping|pulire|clean|towel|asciugaman)\b',
-        r'\b(manutenzione|maintenance|riparazione|repair)\b',
-        r'\b(prenotare|prenota|book|reservation|reserve)\b',
-        r'\b(spa|massaggio|massage)\b',
-        r'\b(transfer|taxi|trasporto)\b',
-        r'\b(chiamare|call|contattare|contact)\b',
-        r'\b(ho bisogno|need|necessito)\b'
-    ]
-    
-    service_score = sum(1 for p in service_patterns if re.search(p, message_lower, re.IGNORECASE))
-    
-    # Priority 4: RECOMMENDATION - Consigli e raccomandazioni
-    recommendation_patterns = [
-        r'\b(consiglio|consiglia|recommend|suggest|sugger)\b',
-        r'\b(ristorante|restaurant|mangiare|eat|cena|dinner|pranzo|lunch)\b',
-        r'\b(visitare|visit|vedere|see|cosa fare|what to do)\b',
-        r'\b(attrazione|attraction|museo|museum|monumento)\b',
-        r'\b(dove|where|come arriv|how to get)\b',
-        r'\b(shopping|negozi|shop)\b',
-        r'\b(migliore|best|top)\b'
-    ]
+    return _CLASSIFIER.classify(guest_message)[0]
+
+
+def analyze_guest_message(guest_message: str) -> ClassificationResult:
+    """
+    Classificazione completa del messaggio, da calcolare una volta per turno.
     
-    recommendation_score = sum(1 for p in recommendation_patterns if re.search(p, message_lower, re.IGNORECASE))
+    Args:
+        guest_message: Messaggio dell'ospite
     
-    # Priority 5: HOTEL INFO - Informazioni sull'hotel
-    info_patterns = [
-        r'\b(a che ora|at what time|che ora|orario|orari|hour)\b',
-        r'\b(quali sono|what are)\b',
-        r'\b(c\'è|ci sono|is there|are there|have you|avete)\b',
-        r'\b(informazione|information|info)\b',
-        r'\b(check.?in|check.?out)\b',
-        r'\b(wifi|internet|password)\b',
-        r'\b(colazione|breakfast)\b(?!.*\b(prenota|order|vorrei))',
-        r'\b(parcheggio|parking)\b',
-        r'\b(quanto cost|how much|prezzo|price)\b'
-    ]
+    Returns:
+        ClassificationResult: intent, confidence, score per intent e keyword matchate
     
-    info_score = sum(1 for p in info_patterns if re.search(p, message_lower, re.IGNORECASE))
-    
-    # Decision logic basata su score con priorità
-    scores = {
-        'complaint': complaint_score,
-        'service_request': service_score,
-        'recommendation': recommendation_score,
-        'hotel_info': info_score
-    }
-    
-    max_score = max(scores.values())
-    
-    # Se nessun match, è special_request
-    if max_score == 0:
-        return 'special_request'
-    
-    # Priorità in caso di parità: complaint > service > recommendation > info
-    # Ma se c'è un chiaro vincitore (>1.5x altri), usa quello
-    if scores['complaint'] >= max_score and complaint_score > 0:
-        return 'complaint'
-    elif scores['service_request'] >= max_score and service_score > 0:
-        # Check se non è più probabile hotel_info per domande tipo "A che ora..."
-        if info_score > 0 and 'quando' in message_lower or 'che ora' in message_lower or 'orario' in message_lower or 'quali sono' in message_lower:
-            if 'prenota' not in message_lower and 'vorrei' not in message_lower and 'posso' not in message_lower:
-                return 'hotel_info'
-        return 'service_request'
-    elif scores['recommendation'] >= max_score and recommendation_score > 0:
-        return 'recommendation'
-    elif scores['hotel_info'] >= max_score and info_score > 0:
-        return 'hotel_info'
-    else:
-        return 'special_request'
+    Examples:
+        >>> result = analyze_guest_message("Consigli un ristorante?")
+        >>> result.intent, result.confidence
+        ('recommendation', 0.7)
+        >>> result.first_match(RECOMMENDATION_CATEGORY_KEYWORDS)
+        'dining'
+    """
+    return _CLASSIFIER.analyze(guest_message)
 
 
 def get_intent_confidence(guest_message: str) -> tuple[Intent, float]:
@@ -156,25 +319,8 @@ def get_intent_confidence(guest_message: str) -> tuple[Intent, float]:
     
     Returns:
         tuple: (intent, confidence_score) dove confidence è tra 0.0 e 1.0
+    
+    Note:
+        Intent e confidenza sono calcolati nella stessa passata sul messaggio
     """
-    intent = classify_guest_intent(guest_message)
-    
-    # Calcolo confidenza semplificato basato su match count
-    message_lower = guest_message.lower()
-    
-    # Pattern per l'intent rilevato
-    pattern_map = {
-        'emergency': [r'\b(emergenza|emergency|aiuto|urgente)\b'],
-        'complaint': [r'\b(lament|problem|non funziona|sporco|rumore)\b'],
-        'service_request': [r'\b(vorrei|room service|prenotare|spa|transfer)\b'],
-        'recommendation': [r'\b(consiglio|ristorante|visitare|dove)\b'],
-        'hotel_info': [r'\b(orario|c\'è|check.?in|wifi|colazione)\b']
-    }
-    
-    if intent in pattern_map:
-        matches = sum(1 for p in pattern_map[intent] if re.search(p, message_lower, re.IGNORECASE))
-        confidence = min(0.5 + (matches * 0.2), 1.0)
-    else:
-        confidence = 0.3  # special_request ha confidenza bassa
-    
-    return intent, confidence
+    return _CLASSIFIER.classify(guest_message)
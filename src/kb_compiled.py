@@ -0,0 +1,256 @@
+"""
+Knowledge Base Compilata
+Formato binario colonnare, mappato in memoria e condivisibile tra processi
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+from collections.abc import Sequence
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+# Header: magic, versione formato, n documenti, n categorie, fingerprint (SHA-1 hex)
+_MAGIC = b'HKB1'
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct('<4sIQQ40s')
+
+# Campi testuali principali, ognuno con la propria colonna di offset
+_TEXT_FIELDS = ('id', 'question', 'answer')
+
+# Codice categoria riservato ai documenti senza categoria
+_NO_CATEGORY = np.iinfo(np.uint16).max
+
+
+def content_fingerprint(kb_data) -> str:
+    """Hash stabile del contenuto KB, indipendente dal formato di origine"""
+    payload = json.dumps(list(kb_data), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def is_compiled_knowledge_base(path: str) -> bool:
+    """True se il file inizia con il magic del formato compilato"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(_MAGIC)) == _MAGIC
+    except OSError:
+        return False
+
+
+def _aligned(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def compile_knowledge_base(kb_data: list, output_path: str) -> str:
+    """
+    Compila la knowledge base nel formato binario mappabile.
+    
+    Layout (little-endian, sezioni allineate a 8 byte):
+        header | codici categoria uint16[n] | presenza campi uint8[n] |
+        offset nomi categoria uint64[c+1] | offset per campo uint64[n+1]
+        (id, question, answer, extra) | blob UTF-8
+    
+    Args:
+        kb_data: Lista di dizionari con knowledge base
+        output_path: Path del file compilato (sostituito atomicamente)
+    
+    Returns:
+        str: Fingerprint del contenuto (uguale a quello della KB JSON)
+    
+    Raises:
+        ValueError: Se le categorie distinte superano il limite di uint16
+    
+    Examples:
+        >>> kb = load_knowledge_base("data/hotel_knowledge_base.json")
+        >>> compile_knowledge_base(kb, "data/hotel_knowledge_base.hkb")
+        >>> kb = load_knowledge_base("data/hotel_knowledge_base.hkb")
+    
+    Note:
+        I campi non testuali o aggiuntivi vengono salvati come JSON nella
+        colonna 'extra', così ogni documento viene ricostruito identico
+    """
+    kb_list = list(kb_data)
+    n_docs = len(kb_list)
+    
+    categories: Dict[str, int] = {}
+    codes = np.empty(n_docs, dtype='<u2')
+    presence = np.zeros(n_docs, dtype=np.uint8)
+    columns: List[List[bytes]] = [[] for _ in range(len(_TEXT_FIELDS) + 1)]
+    
+    for i, doc in enumerate(kb_list):
+        extra = {}
+        category = doc.get('category')
+        if isinstance(category, str):
+            if category not in categories:
+                if len(categories) >= _NO_CATEGORY:
+                    raise ValueError("Too many knowledge base categories for the compiled format")
+                categories[category] = len(categories)
+            codes[i] = categories[category]
+        else:
+            codes[i] = _NO_CATEGORY
+            if 'category' in doc:
+                extra['category'] = category
+        
+        for f, field in enumerate(_TEXT_FIELDS):
+            value = doc.get(field)
+            if isinstance(value, str):
+                presence[i] |= 1 << f
+                columns[f].append(value.encode('utf-8'))
+            else:
+                columns[f].append(b'')
+                if field in doc:
+                    extra[field] = value
+        
+        for key, value in doc.items():
+            if key != 'category' and key not in _TEXT_FIELDS:
+                extra[key] = value
+        columns[-1].append(json.dumps(extra, ensure_ascii=False).encode('utf-8') if extra else b'')
+    
+    # Blob: nomi categoria, poi le colonne testuali in sequenza
+    blob = bytearray()
+    category_offsets = np.empty(len(categories) + 1, dtype='<u8')
+    for code, name in enumerate(categories):
+        category_offsets[code] = len(blob)
+        blob += name.encode('utf-8')
+    category_offsets[-1] = len(blob)
+    
+    field_offsets = []
+    for values in columns:
+        offsets = np.empty(n_docs + 1, dtype='<u8')
+        for i, value in enumerate(values):
+            offsets[i] = len(blob)
+            blob += value
+        offsets[-1] = len(blob)
+        field_offsets.append(offsets)
+    
+    fingerprint = content_fingerprint(kb_list)
+    sections = [codes.tobytes(), presence.tobytes(), category_offsets.tobytes()]
+    sections += [offsets.tobytes() for offsets in field_offsets]
+    
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, n_docs, len(categories), fingerprint.encode('ascii')))
+        for section in sections:
+            f.write(section)
+            f.write(b'\0' * (_aligned(len(section)) - len(section)))
+        f.write(blob)
+    # Sostituzione atomica: i processi che hanno già mappato il file
+    # continuano a leggere la versione precedente
+    os.replace(tmp_path, output_path)
+    return fingerprint
+
+
+class CompiledKnowledgeBase(Sequence):
+    """
+    Knowledge base compilata, letta via mmap senza parsing all'avvio.
+    
+    Si comporta come una sequenza read-only di documenti: ogni accesso
+    decodifica solo i campi del documento richiesto. Colonne e testo
+    restano nelle pagine del file mappato, condivise tra i processi worker.
+    
+    Examples:
+        >>> kb = CompiledKnowledgeBase("data/hotel_knowledge_base.hkb")
+        >>> len(kb), kb[0]['id']
+        (22, 'service_001')
+        >>> kb.category_rows()['dining']
+        array([...])
+    
+    Note:
+        - Ogni accesso restituisce un nuovo dict, di proprietà del chiamante
+        - Le colonne numpy sono viste read-only sul file mappato
+    """
+    
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Path del file prodotto da compile_knowledge_base
+        
+        Raises:
+            ValueError: Se il file non è una KB compilata valida
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        if len(self._mmap) < _HEADER.size:
+            raise ValueError(f"Invalid compiled knowledge base: {path}")
+        magic, version, n_docs, n_categories, fingerprint = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC or version != _FORMAT_VERSION:
+            raise ValueError(f"Unsupported compiled knowledge base format: {path}")
+        
+        self._length = n_docs
+        self.fingerprint = fingerprint.decode('ascii')
+        
+        offset = _HEADER.size
+        self.category_codes, offset = self._column('<u2', n_docs, offset)
+        self._presence, offset = self._column(np.uint8, n_docs, offset)
+        category_offsets, offset = self._column('<u8', n_categories + 1, offset)
+        self._field_offsets = []
+        for _ in range(len(_TEXT_FIELDS) + 1):
+            offsets, offset = self._column('<u8', n_docs + 1, offset)
+            self._field_offsets.append(offsets)
+        self._blob = memoryview(self._mmap)[offset:]
+        
+        self.categories = [
+            self._text(int(category_offsets[c]), int(category_offsets[c + 1]))
+            for c in range(n_categories)
+        ]
+    
+    def _column(self, dtype, count: int, offset: int):
+        array = np.frombuffer(self._mmap, dtype=dtype, count=count, offset=offset)
+        return array, offset + _aligned(array.nbytes)
+    
+    def _text(self, start: int, end: int) -> str:
+        return str(self._blob[start:end], 'utf-8')
+    
+    def _field(self, f: int, i: int) -> str:
+        offsets = self._field_offsets[f]
+        return self._text(int(offsets[i]), int(offsets[i + 1]))
+    
+    def __len__(self) -> int:
+        return self._length
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._length))]
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError("knowledge base index out of range")
+        
+        presence = int(self._presence[i])
+        doc = {}
+        if presence & 1:
+            doc['id'] = self._field(0, i)
+        code = int(self.category_codes[i])
+        if code != _NO_CATEGORY:
+            doc['category'] = self.categories[code]
+        for f in range(1, len(_TEXT_FIELDS)):
+            if presence & (1 << f):
+                doc[_TEXT_FIELDS[f]] = self._field(f, i)
+        
+        extra = self._field(len(_TEXT_FIELDS), i)
+        if extra:
+            doc.update(json.loads(extra))
+        return doc
+    
+    def ids(self) -> List[Optional[str]]:
+        """Colonna degli id, senza decodificare gli altri campi"""
+        has_id = self._presence & 1
+        return [self._field(0, i) if has_id[i] else self[i].get('id') for i in range(self._length)]
+    
+    def category_rows(self) -> Dict[Optional[str], np.ndarray]:
+        """Indici dei documenti per categoria, calcolati sulla colonna dei codici"""
+        order = np.argsort(self.category_codes, kind='stable')
+        sorted_codes = self.category_codes[order]
+        codes, starts = np.unique(sorted_codes, return_index=True)
+        bounds = list(starts[1:]) + [len(order)]
+        
+        rows = {}
+        for code, start, end in zip(codes, starts, bounds):
+            name = None if code == _NO_CATEGORY else self.categories[code]
+            rows[name] = order[start:end].astype(np.intp)
+        return rows
@@ -0,0 +1,126 @@
+"""
+Watcher della Knowledge Base
+Rileva modifiche al file KB e avvia il reload in background
+"""
+import hashlib
+import os
+import threading
+from typing import Callable, Optional, Tuple
+
+
+def _file_signature(path: str) -> Optional[Tuple[int, int]]:
+    """(mtime_ns, size) del file, None se non esiste"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _file_hash(path: str) -> Optional[str]:
+    """SHA-1 del contenuto del file, None se non leggibile"""
+    digest = hashlib.sha1()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+class KnowledgeBaseWatcher:
+    """
+    Polling del file KB: mtime/size come trigger economico, hash del
+    contenuto come conferma.
+    
+    Quando il contenuto cambia chiama on_change nel thread del watcher, così
+    il rebuild dell'indice non pesa mai sulle richieste degli ospiti.
+    
+    Examples:
+        >>> watcher = KnowledgeBaseWatcher(
+        ...     "data/hotel_knowledge_base.json",
+        ...     on_change=bot.reload_knowledge_base,
+        ...     poll_interval=2.0
+        ... )
+        >>> watcher.start()
+        >>> watcher.stop()
+    
+    Note:
+        - Un touch senza modifiche (stesso hash) non provoca reload
+        - Se on_change fallisce (es. JSON scritto a metà) il contenuto non
+          viene marcato come caricato: il reload viene ritentato alla
+          modifica successiva del file
+    """
+    
+    def __init__(
+        self,
+        kb_path: str,
+        on_change: Callable[[], object],
+        poll_interval: float = 2.0
+    ):
+        """
+        Args:
+            kb_path: Path del file della knowledge base
+            on_change: Callback senza argomenti invocata a contenuto cambiato
+            poll_interval: Secondi tra due controlli del file
+        """
+        self.kb_path = kb_path
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        
+        # Stato del contenuto già caricato
+        self._signature = _file_signature(kb_path)
+        self._hash = _file_hash(kb_path)
+        
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.reloads = 0
+        self.errors = 0
+    
+    def check_now(self) -> bool:
+        """
+        Controlla il file e, se il contenuto è cambiato, esegue on_change.
+        
+        Returns:
+            bool: True se è stato eseguito un reload con successo
+        """
+        signature = _file_signature(self.kb_path)
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        
+        content_hash = _file_hash(self.kb_path)
+        if content_hash is None or content_hash == self._hash:
+            return False
+        
+        try:
+            self.on_change()
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️ Reload knowledge base fallito: {e}")
+            return False
+        
+        self._hash = content_hash
+        self.reloads += 1
+        return True
+    
+    def start(self):
+        """Avvia il polling in un thread daemon (idempotente)"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="kb-watcher", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Ferma il polling e attende il thread"""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+    
+    def _run(self):
+        while not self._stop_event.wait(self.poll_interval):
+            self.check_now()
@@ -0,0 +1,135 @@
+"""
+Keyword Matcher Multi-Pattern (Aho-Corasick)
+Un unico automa costruito una volta da tutti i vocabolari del bot:
+routing degli handler, priorità delle richieste ed escalation
+"""
+from typing import Dict, FrozenSet, Iterable, List
+
+
+# Vocabolari di routing degli handler del bot (match per sottostringa,
+# in ordine di priorità): categoria KB per le raccomandazioni e tipo servizio
+RECOMMENDATION_CATEGORY_KEYWORDS = {
+    'dining': ['ristorante', 'mangiare', 'cena', 'pranzo', 'restaurant', 'dining'],
+    'local_attractions': ['visitare', 'vedere', 'museo', 'attrazione', 'visit', 'see', 'museum'],
+    'transport': ['trasporto', 'taxi', 'vaporetto', 'transport']
+}
+
+SERVICE_TYPE_KEYWORDS = {
+    'room_service': ['room service', 'servizio in camera', 'ordinare', 'order'],
+    'housekeeping': ['pulizie', 'housekeeping', 'pulire', 'towel', 'asciugaman'],
+    'maintenance': ['manutenzione', 'maintenance', 'riparazione', 'repair', 'rotto'],
+    'spa_booking': ['spa', 'massaggio', 'massage'],
+    'restaurant_booking': ['ristorante', 'restaurant', 'tavolo', 'table']
+}
+
+# Priorità richieste di servizio
+URGENT_KEYWORDS = ['urgente', 'urgent', 'subito', 'immediately', 'asap', 'emergenza']
+
+CRITICAL_MAINTENANCE_KEYWORDS = ['acqua', 'water', 'leak', 'perdita', 'allagamento',
+                                 'elettric', 'luce', 'riscaldamento', 'aria condizionata']
+
+# Escalation: segnali di lamentela nella conversazione
+COMPLAINT_ESCALATION_KEYWORDS = ['problem', 'lament']
+
+
+class KeywordMatcher:
+    """
+    Automa Aho-Corasick per match multi-keyword in una sola passata.
+    
+    Riporta tutte le keyword contenute nel testo (semantica "kw in testo",
+    incluse sovrapposizioni) in O(len(testo) + hit), indipendentemente dal
+    numero di keyword nei vocabolari.
+    
+    Examples:
+        >>> matcher = KeywordMatcher(['spa', 'massaggio', 'asap'])
+        >>> sorted(matcher.find("vorrei un massaggio alla spa asap"))
+        ['asap', 'massaggio', 'spa']
+        >>> matcher.matches_any("spa asap", ['asap', 'subito'])
+        True
+    
+    Note:
+        Il testo va passato già normalizzato (es. lower()), come le keyword
+    """
+    
+    def __init__(self, keywords: Iterable[str]):
+        """
+        Costruisce trie e failure link.
+        
+        Args:
+            keywords: Keyword da riconoscere
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[FrozenSet[str]] = [frozenset()]
+        
+        for keyword in keywords:
+            if keyword:
+                self._insert(keyword)
+        
+        self._build_failure_links()
+    
+    def _insert(self, keyword: str):
+        state = 0
+        for ch in keyword:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(frozenset())
+            state = next_state
+        self._out[state] = self._out[state] | {keyword}
+    
+    def _build_failure_links(self):
+        """BFS sul trie: failure link e output ereditati dai suffissi"""
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, child in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(ch, 0)
+                self._out[child] = self._out[child] | self._out[self._fail[child]]
+                queue.append(child)
+    
+    def find(self, text: str) -> FrozenSet[str]:
+        """
+        Tutte le keyword contenute nel testo.
+        
+        Args:
+            text: Testo normalizzato da analizzare
+        
+        Returns:
+            frozenset: Keyword trovate
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return frozenset(found)
+    
+    def matches_any(self, text: str, keywords: Iterable[str]) -> bool:
+        """True se almeno una delle keyword è contenuta nel testo"""
+        found = self.find(text)
+        return any(kw in found for kw in keywords)
+
+
+def _all_keywords() -> List[str]:
+    keywords = []
+    for vocabulary in (RECOMMENDATION_CATEGORY_KEYWORDS, SERVICE_TYPE_KEYWORDS):
+        for group in vocabulary.values():
+            keywords.extend(group)
+    keywords.extend(URGENT_KEYWORDS)
+    keywords.extend(CRITICAL_MAINTENANCE_KEYWORDS)
+    keywords.extend(COMPLAINT_ESCALATION_KEYWORDS)
+    return keywords
+
+
+# Automa condiviso da classificazione, priorità ed escalation
+SHARED_MATCHER = KeywordMatcher(_all_keywords())
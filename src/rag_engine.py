@@ -3,16 +3,1048 @@ RAG Engine per Knowledge Base Hotel
 Gestisce ricerca semantica e generazione risposte per il concierge bot
 """
 import json
-from typing import List, Dict, Optional
+import os
+import time
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import List, Dict, NamedTuple, Optional, Tuple
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
 import numpy as np
 
+from kb_compiled import CompiledKnowledgeBase, content_fingerprint, is_compiled_knowledge_base
+
+
+# Parametri TF-IDF condivisi da indice persistente e ricerca ad-hoc
+TFIDF_PARAMS = {
+    'lowercase': True,
+    'ngram_range': (1, 2),  # unigrams e bigrams
+    'max_features': 500,
+    'stop_words': None  # Manteniamo stop words per italiano
+}
+
+
+def _top_k_indices(
+    scores: np.ndarray,
+    top_k: int,
+    tie_keys: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Seleziona gli indici dei top_k score, ordinati per score decrescente.
+    
+    Args:
+        scores: Array 1D di score
+        top_k: Numero di elementi da selezionare
+        tie_keys: Chiavi per gli spareggi, allineate a scores (opzionale,
+                  default la posizione stessa)
+    
+    Returns:
+        np.ndarray: Indici selezionati (a parità di score vince la chiave minore)
+    
+    Note:
+        Usa np.argpartition (O(n)) e ordina solo i k candidati, invece di
+        un argsort completo O(n log n) su tutta la KB
+    """
+    n = scores.shape[0]
+    k = min(top_k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    keys = np.arange(n) if tie_keys is None else tie_keys
+    
+    if k < n:
+        kth_score = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        above = np.flatnonzero(scores > kth_score)
+        ties = np.flatnonzero(scores == kth_score)
+        if tie_keys is not None:
+            ties = ties[np.argsort(keys[ties], kind='stable')]
+        candidates = np.concatenate([above, ties[:k - len(above)]])
+    else:
+        candidates = np.arange(n)
+    
+    # Ordina i k candidati: score decrescente, poi chiave crescente
+    order = np.lexsort((keys[candidates], -scores[candidates]))
+    return candidates[order]
+
+
+def _kb_fingerprint(kb_data: list) -> str:
+    """Hash stabile del contenuto KB, usato per validare un indice salvato"""
+    if isinstance(kb_data, CompiledKnowledgeBase):
+        return kb_data.fingerprint
+    return content_fingerprint(kb_data)
+
+
+def _as_documents(kb_data):
+    """Sequenza di documenti dell'indice: la KB compilata (immutabile) non viene copiata"""
+    if isinstance(kb_data, CompiledKnowledgeBase):
+        return kb_data
+    return list(kb_data)
+
+
+class SearchResult(Mapping):
+    """
+    Risultato di ricerca: riferimento a un documento della KB più lo score.
+    
+    Non copia il documento: tiene la sequenza della KB e la posizione, e si
+    comporta come una vista read-only del dict documento + 'score'. Il
+    codice esistente che usa result['answer'], result.get('score') o
+    'score' in result continua a funzionare senza allocare un dict per hit.
+    
+    Examples:
+        >>> results = index.search("orari colazione")
+        >>> results[0]['question'], results[0].score
+        ('A che ora è la colazione?', 0.61)
+        >>> results[0].to_dict()
+        {'id': 'dining_001', ..., 'score': 0.61}
+    
+    Note:
+        - I documenti della KB sono condivisi: non vanno modificati
+        - to_dict() restituisce la vista dict-shaped storica (una copia);
+          le funzioni di ricerca accettano as_dicts=True per riceverla
+          direttamente (es. per json.dumps o per modificare i risultati)
+    """
+    
+    __slots__ = ('_documents', 'position', 'score', '_doc')
+    
+    def __init__(self, documents, position: int, score: float):
+        """
+        Args:
+            documents: Sequenza di documenti (lista o KB compilata)
+            position: Indice del documento nella sequenza
+            score: Score di rilevanza
+        """
+        self._documents = documents
+        self.position = position
+        self.score = score
+        self._doc = None
+    
+    @classmethod
+    def from_document(cls, doc: Dict, score: float) -> 'SearchResult':
+        """Risultato per un documento già materializzato (senza sequenza di origine)"""
+        result = cls(None, None, score)
+        result._doc = doc
+        return result
+    
+    @property
+    def document(self) -> Dict:
+        """Documento KB referenziato (decodificato una sola volta per la KB compilata)"""
+        if self._doc is None:
+            self._doc = self._documents[self.position]
+        return self._doc
+    
+    def with_score(self, score: float) -> 'SearchResult':
+        """Stesso documento con un nuovo score (il documento non viene copiato)"""
+        result = SearchResult(self._documents, self.position, score)
+        result._doc = self._doc
+        return result
+    
+    def to_dict(self) -> Dict:
+        """Copia dict-shaped del risultato (documento + 'score')"""
+        result = dict(self.document)
+        result['score'] = self.score
+        return result
+    
+    def __getitem__(self, key):
+        if key == 'score':
+            return self.score
+        return self.document[key]
+    
+    def __iter__(self):
+        doc = self.document
+        yield from doc
+        if 'score' not in doc:
+            yield 'score'
+    
+    def __len__(self) -> int:
+        doc = self.document
+        return len(doc) + ('score' not in doc)
+    
+    def __repr__(self) -> str:
+        return f"SearchResult(id={self.get('id')!r}, score={self.score:.4f})"
+
+
+def results_as_dicts(results: list) -> List[Dict]:
+    """
+    Vista di compatibilità: copie dict indipendenti dei risultati.
+    
+    Args:
+        results: SearchResult (o documenti dict) restituiti da una ricerca
+    
+    Returns:
+        List[Dict]: Dizionari {id, category, question, answer, score}
+                    serializzabili con json e modificabili dal chiamante
+    """
+    return [r.to_dict() if isinstance(r, SearchResult) else dict(r) for r in results]
+
+
+class KeywordIndex:
+    """
+    Indice invertito token -> doc id per la ricerca keyword di fallback.
+    
+    Costruito una volta insieme alla KB: lo scoring tocca solo i documenti
+    che condividono almeno un token con la query, invece di ri-tokenizzare
+    l'intera knowledge base ad ogni chiamata.
+    
+    Note:
+        - Tokenizzazione identica al fallback storico: lower() + split()
+        - Score = token in comune / token distinti della query
+    """
+    
+    def __init__(self, kb_data: list):
+        """
+        Args:
+            kb_data: Lista di dizionari con knowledge base
+        """
+        self.kb_data = _as_documents(kb_data)
+        self.categories = [doc.get('category') for doc in self.kb_data]
+        self.postings: Dict[str, List[int]] = {}
+        
+        for doc_id, doc in enumerate(self.kb_data):
+            doc_text = f"{doc.get('question', '')} {doc.get('answer', '')}".lower()
+            for token in set(doc_text.split()):
+                self.postings.setdefault(token, []).append(doc_id)
+    
+    def search(self, query: str, category: Optional[str] = None, top_k: int = 5) -> list:
+        """
+        Cerca per keyword usando le postings list.
+        
+        Args:
+            query: Query di ricerca dell'ospite
+            category: Filtra per categoria specifica (opzionale)
+            top_k: Numero massimo di risultati
+        
+        Returns:
+            list: SearchResult con almeno un token in comune, ordinati per score
+        """
+        query_words = set(query.lower().split())
+        if not query_words:
+            return []
+        
+        # Conta i token in comune scorrendo solo le postings della query
+        common_counts: Dict[int, int] = {}
+        for word in query_words:
+            for doc_id in self.postings.get(word, ()):
+                common_counts[doc_id] = common_counts.get(doc_id, 0) + 1
+        
+        matches = [
+            (doc_id, count) for doc_id, count in common_counts.items()
+            if not category or self.categories[doc_id] == category
+        ]
+        if not matches:
+            return []
+        doc_ids = np.fromiter((doc_id for doc_id, _ in matches), dtype=np.intp, count=len(matches))
+        scores = np.fromiter((count for _, count in matches), dtype=float, count=len(matches))
+        scores /= len(query_words)
+        
+        # Niente sort dei candidati: gli spareggi usano direttamente il doc id
+        return [
+            SearchResult(self.kb_data, int(doc_ids[idx]), float(scores[idx]))
+            for idx in _top_k_indices(scores, top_k, tie_keys=doc_ids)
+        ]
+
+
+# Tag di preferenza precalcolati nella matrice documento x tag
+PREFERENCE_TAGS = (
+    # Interessi
+    'art', 'history', 'culture', 'food', 'wine', 'music', 'nature', 'shopping',
+    # Esigenze alimentari
+    'vegetarian', 'vegan', 'gluten-free', 'lactose-free', 'halal', 'kosher'
+)
+
+
+def _text_boost(doc: Dict, weights: Dict[str, float]) -> float:
+    """Boost calcolato sul testo del documento (per risultati fuori dalla matrice)"""
+    text = f"{doc.get('question', '')} {doc.get('answer', '')}".lower()
+    return sum(weight for tag, weight in weights.items() if tag in text)
+
+
+class PreferenceTagMatrix:
+    """
+    Matrice booleana documento x tag per il boost delle preferenze ospite.
+    
+    Ogni cella indica se il tag compare nel testo (question + answer, in
+    minuscolo) del documento: il boost di un profilo ospite diventa un
+    singolo prodotto matrice-vettore, anche sull'intera knowledge base.
+    
+    Examples:
+        >>> tags = PreferenceTagMatrix(kb)
+        >>> boosts = tags.boosts({'art': 0.2, 'vegetarian': 0.15})
+        >>> ranked = tags.rank_rows(index.category_rows['dining'], {'wine': 0.2})
+    
+    Note:
+        - Stessa semantica del confronto storico: tag.lower() in testo
+        - I testi servono solo durante la costruzione e non restano in memoria
+        - I tag fuori da PREFERENCE_TAGS vengono valutati sul testo dei soli
+          documenti richiesti, senza aggiungere colonne: la matrice non
+          cresce con i profili degli ospiti
+        - Immutabile dopo la costruzione: nessun lock in lettura
+    """
+    
+    def __init__(self, kb_data, tags=PREFERENCE_TAGS):
+        """
+        Args:
+            kb_data: Sequenza di documenti (tipicamente index.kb_data)
+            tags: Tag da precalcolare (in minuscolo)
+        """
+        self.kb_data = kb_data
+        self.columns: Dict[str, int] = {tag: i for i, tag in enumerate(dict.fromkeys(tags))}
+        
+        matrix = np.zeros((len(kb_data), len(self.columns)), dtype=bool)
+        for row, doc in enumerate(kb_data):
+            text = f"{doc.get('question', '')} {doc.get('answer', '')}".lower()
+            matrix[row] = [tag in text for tag in self.columns]
+        matrix.setflags(write=False)
+        self.matrix = matrix
+    
+    @property
+    def tags(self) -> List[str]:
+        """Tag con una colonna nella matrice, nell'ordine delle colonne"""
+        return list(self.columns)
+    
+    def boosts(self, weights: Dict[str, float], rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Calcola il boost dei documenti per un profilo di preferenze.
+        
+        Args:
+            weights: Peso per tag, es. {'art': 0.2, 'vegetarian': 0.15}
+                     (tag ripetuti nel profilo = pesi sommati)
+            rows: Posizioni dei documenti da valutare (None = tutta la KB)
+        
+        Returns:
+            np.ndarray: Boost per documento, allineato a rows (o a kb_data)
+        """
+        known = {tag: weight for tag, weight in weights.items() if tag in self.columns}
+        selected = np.array([self.columns[tag] for tag in known], dtype=np.intp)
+        block = self.matrix[:, selected] if rows is None else self.matrix[np.ix_(rows, selected)]
+        boosts = block @ np.fromiter(known.values(), dtype=float, count=len(known))
+        
+        # Tag non precalcolati: confronto testuale sui soli documenti richiesti
+        unknown = {tag: weight for tag, weight in weights.items() if tag not in self.columns}
+        if unknown:
+            positions = range(len(self.kb_data)) if rows is None else rows
+            boosts += np.fromiter(
+                (_text_boost(self.kb_data[int(p)], unknown) for p in positions),
+                dtype=float, count=len(boosts)
+            )
+        return boosts
+    
+    def rank_rows(self, rows: np.ndarray, weights: Dict[str, float], base_score: float = 0.5) -> list:
+        """
+        Ordina un sottoinsieme di documenti per score personalizzato.
+        
+        Args:
+            rows: Posizioni dei documenti in kb_data (es. una categoria)
+            weights: Peso per tag del profilo ospite
+            base_score: Score di partenza dei documenti
+        
+        Returns:
+            list: SearchResult ordinati per score decrescente (ordine stabile)
+        """
+        scores = np.minimum(base_score + self.boosts(weights, rows), 1.0)
+        order = np.argsort(-scores, kind='stable')
+        return [SearchResult(self.kb_data, int(rows[i]), float(scores[i])) for i in order]
+
+
+def rescore_results(
+    results: list,
+    weights: Dict[str, float],
+    tags: Optional[PreferenceTagMatrix] = None,
+    default_score: float = 0.5
+) -> list:
+    """
+    Applica il boost delle preferenze a risultati già calcolati e li riordina.
+    
+    Args:
+        results: SearchResult o documenti dict (es. output di una ricerca)
+        weights: Peso per tag del profilo ospite
+        tags: Matrice documento x tag dell'indice corrente (opzionale)
+        default_score: Score di partenza per i risultati senza score
+    
+    Returns:
+        list: SearchResult ordinati per score decrescente (ordine stabile)
+    
+    Note:
+        I risultati che non referenziano tags.kb_data (es. ricerca ad-hoc
+        su una KB filtrata, o nessuna matrice) ricadono sul confronto testuale
+    """
+    matched = [
+        i for i, result in enumerate(results)
+        if tags is not None and isinstance(result, SearchResult) and result._documents is tags.kb_data
+    ]
+    boosts = {}
+    if matched:
+        rows = np.array([results[i].position for i in matched], dtype=np.intp)
+        boosts = dict(zip(matched, tags.boosts(weights, rows)))
+    
+    scored = []
+    for i, result in enumerate(results):
+        boost = float(boosts[i]) if i in boosts else _text_boost(result, weights)
+        score = min(result.get('score', default_score) + boost, 1.0)
+        
+        # Nuovo SearchResult sullo stesso documento, senza copiarlo
+        if isinstance(result, SearchResult):
+            scored.append(result.with_score(score))
+        else:
+            scored.append(SearchResult.from_document(result, score))
+    
+    scored.sort(key=lambda r: r.score, reverse=True)
+    return scored
+
+
+class KnowledgeIndex:
+    """
+    Indice TF-IDF pre-calcolato sulla knowledge base.
+    
+    Il vectorizer viene fittato una sola volta (all'avvio del bot) e la
+    matrice sparsa dei documenti resta in memoria: ogni query costa una
+    singola transform più un prodotto sparso.
+    
+    Examples:
+        >>> kb = load_knowledge_base()
+        >>> index = KnowledgeIndex(kb)
+        >>> results = index.search("orari colazione")
+        >>> index.save("data/kb_index.npz")
+        >>> index = KnowledgeIndex.load("data/kb_index.npz", kb)
+    
+    Note:
+        - Le righe della matrice sono normalizzate L2, quindi il prodotto
+          scalare con la query coincide con la cosine similarity
+        - Il file salvato contiene matrice, vocabolario, idf e fingerprint KB
+        - keyword_index (indice invertito) serve il fallback keyword;
+          warm() lo costruisce prima della pubblicazione dell'indice
+        - preference_tags (matrice documento x tag) serve la personalizzazione
+        - Immutabile dopo la costruzione (array numpy read-only): le ricerche
+          concorrenti da più thread non richiedono lock
+        - add_entry/update_entry/remove_entry restituiscono un nuovo indice
+          (copy-on-write) ricalcolando solo le righe toccate con il
+          vocabolario e gli idf correnti; oltre refit_threshold di righe
+          modificate dall'ultimo fit, o se la voce porta parole nuove per
+          il corpus, viene rifittato tutto il corpus
+    """
+    
+    def __init__(self, kb_data: list, refit_threshold: float = 0.2):
+        """
+        Costruisce l'indice fittando TF-IDF su tutta la knowledge base.
+        
+        Args:
+            kb_data: Lista di dizionari con knowledge base
+            refit_threshold: Frazione di righe modificate incrementalmente
+                             oltre la quale add/update/remove rifittano tutto
+        """
+        kb_list = _as_documents(kb_data)
+        vectorizer = None
+        doc_matrix = None
+        
+        if kb_list:
+            vectorizer = TfidfVectorizer(**TFIDF_PARAMS)
+            doc_matrix = vectorizer.fit_transform(
+                [self._document_text(doc) for doc in kb_list]
+            ).tocsr()
+        
+        self._assemble(kb_list, vectorizer, doc_matrix, refit_threshold)
+    
+    def _assemble(
+        self,
+        kb_data: list,
+        vectorizer: Optional[TfidfVectorizer],
+        doc_matrix: Optional[sparse.csr_matrix],
+        refit_threshold: float,
+        fit_size: Optional[int] = None,
+        drift: int = 0,
+        fingerprint: Optional[str] = None,
+        corpus_words: Optional[frozenset] = None
+    ) -> 'KnowledgeIndex':
+        """Inizializza gli attributi derivati e congela l'indice"""
+        self.kb_data = kb_data
+        self.vectorizer = vectorizer
+        self.doc_matrix = doc_matrix
+        self.refit_threshold = refit_threshold
+        self.fit_size = len(kb_data) if fit_size is None else fit_size
+        self.drift = drift
+        if isinstance(kb_data, CompiledKnowledgeBase):
+            # Dalle colonne della KB compilata, senza decodificare i testi
+            self.category_rows = kb_data.category_rows()
+            self.id_rows = {entry_id: i for i, entry_id in enumerate(kb_data.ids())}
+        else:
+            self.category_rows = self._build_category_rows(kb_data)
+            self.id_rows = {doc.get('id'): i for i, doc in enumerate(kb_data)}
+        
+        # Sottomatrici per categoria, così le ricerche filtrate non ricostruiscono una CSR
+        self.category_matrices = {}
+        if doc_matrix is not None:
+            self.category_matrices = {
+                category: doc_matrix[rows] for category, rows in self.category_rows.items()
+            }
+        self._fingerprint = fingerprint
+        self._corpus_words = corpus_words
+        self._keyword_index = None
+        self._preference_tags = None
+        self._freeze()
+        return self
+    
+    @property
+    def fingerprint(self) -> str:
+        """Hash del contenuto KB (calcolato alla prima richiesta)"""
+        if self._fingerprint is None:
+            self._fingerprint = _kb_fingerprint(self.kb_data)
+        return self._fingerprint
+    
+    def warm(self) -> 'KnowledgeIndex':
+        """
+        Costruisce subito le strutture derivate, altrimenti create alla prima richiesta.
+        
+        Da chiamare prima di pubblicare l'indice (load o modifica della KB),
+        così il fallback keyword non costruisce l'indice invertito proprio
+        durante un guasto del motore principale, e la prima raccomandazione
+        non paga la costruzione della matrice documento x tag.
+        
+        Returns:
+            KnowledgeIndex: self, per concatenare la chiamata
+        """
+        if self._keyword_index is None:
+            self._keyword_index = KeywordIndex(self.kb_data)
+        if self._preference_tags is None:
+            self._preference_tags = PreferenceTagMatrix(self.kb_data)
+        return self
+    
+    @property
+    def keyword_index(self) -> KeywordIndex:
+        """Indice invertito per il fallback keyword (costruito alla prima richiesta o da warm())"""
+        if self._keyword_index is None:
+            self._keyword_index = KeywordIndex(self.kb_data)
+        return self._keyword_index
+    
+    @property
+    def preference_tags(self) -> PreferenceTagMatrix:
+        """Matrice documento x tag per la personalizzazione (costruita alla prima richiesta o da warm())"""
+        if self._preference_tags is None:
+            self._preference_tags = PreferenceTagMatrix(self.kb_data)
+        return self._preference_tags
+    
+    def _freeze(self):
+        """Rende read-only gli array condivisi tra i thread di ricerca"""
+        for matrix in [self.doc_matrix, *self.category_matrices.values()]:
+            if matrix is not None:
+                for array in (matrix.data, matrix.indices, matrix.indptr):
+                    array.setflags(write=False)
+        for rows in self.category_rows.values():
+            rows.setflags(write=False)
+    
+    @staticmethod
+    def _document_text(doc: Dict) -> str:
+        """Combina question + answer per search migliore"""
+        return f"{doc.get('question', '')} {doc.get('answer', '')}"
+    
+    @staticmethod
+    def _build_category_rows(kb_data: list) -> Dict[str, np.ndarray]:
+        """Precalcola gli id di riga della matrice per ogni categoria"""
+        rows = {}
+        for i, doc in enumerate(kb_data):
+            rows.setdefault(doc.get('category'), []).append(i)
+        return {cat: np.array(ids, dtype=np.intp) for cat, ids in rows.items()}
+    
+    def __len__(self) -> int:
+        return len(self.kb_data)
+    
+    def category_documents(self, category: str) -> list:
+        """
+        Restituisce i documenti di una categoria senza scansionare la KB.
+        
+        Args:
+            category: Categoria ('dining', 'local_attractions', etc)
+        
+        Returns:
+            list: Documenti della categoria, nell'ordine della KB
+        """
+        rows = self.category_rows.get(category)
+        if rows is None:
+            return []
+        return [self.kb_data[i] for i in rows]
+    
+    def search(self, query: str, category: Optional[str] = None, top_k: int = 5) -> list:
+        """
+        Cerca nell'indice senza rifittare il vectorizer.
+        
+        Args:
+            query: Query di ricerca dell'ospite
+            category: Filtra per categoria specifica (opzionale)
+            top_k: Numero massimo di risultati
+        
+        Returns:
+            list: SearchResult con score > 0, ordinati per score decrescente.
+                  Ogni elemento espone: {id, category, question, answer, score}
+        
+        Note:
+            Il filtro per categoria usa la sottomatrice precalcolata della
+            categoria: nessun nuovo modello viene fittato e nessuna
+            matrice viene allocata per query
+        """
+        if self.doc_matrix is None or not query:
+            return []
+        
+        selection = self._select_rows(category)
+        if selection is None:
+            return []
+        matrix, rows = selection
+        
+        query_vector = self.vectorizer.transform([query.lower()])
+        
+        # Righe normalizzate L2: il prodotto scalare è la cosine similarity
+        similarities = (matrix @ query_vector.T).toarray().ravel()
+        
+        top_indices = _top_k_indices(similarities, top_k)
+        
+        return self._collect_results(similarities, top_indices, rows)
+    
+    def search_batch(
+        self,
+        queries: List[str],
+        category: Optional[str] = None,
+        top_k: int = 5
+    ) -> List[list]:
+        """
+        Cerca più query in un'unica passata sulla matrice.
+        
+        Args:
+            queries: Lista di query degli ospiti
+            category: Filtra per categoria specifica (opzionale)
+            top_k: Numero massimo di risultati per query
+        
+        Returns:
+            list: Una lista di risultati per query, nello stesso formato di search()
+        
+        Note:
+            - Tutte le query vengono trasformate in un'unica matrice sparsa
+            - Gli score sono calcolati con un solo prodotto matriciale
+            - Il top-k per riga usa la selezione parziale di _top_k_indices
+        """
+        queries = list(queries)
+        if self.doc_matrix is None or not queries:
+            return [[] for _ in queries]
+        
+        selection = self._select_rows(category)
+        if selection is None:
+            return [[] for _ in queries]
+        matrix, rows = selection
+        
+        query_matrix = self.vectorizer.transform([(q or '').lower() for q in queries])
+        similarities = (query_matrix @ matrix.T).toarray()
+        
+        return [
+            self._collect_results(row, _top_k_indices(row, top_k), rows) if query else []
+            for query, row in zip(queries, similarities)
+        ]
+    
+    def _select_rows(self, category: Optional[str]):
+        """Restituisce (matrice, row ids) per la categoria, None se sconosciuta"""
+        if not category:
+            return self.doc_matrix, None
+        rows = self.category_rows.get(category)
+        if rows is None:
+            return None
+        return self.category_matrices[category], rows
+    
+    def _collect_results(self, similarities: np.ndarray, top_indices, rows) -> list:
+        """Costruisce i SearchResult per gli indici selezionati (nessuna copia dei documenti)"""
+        results = []
+        for idx in top_indices:
+            if similarities[idx] > 0:  # Solo risultati con score > 0
+                doc_idx = rows[idx] if rows is not None else idx
+                results.append(SearchResult(self.kb_data, int(doc_idx), float(similarities[idx])))
+        return results
+    
+    def _position(self, entry_id: str) -> int:
+        position = self.id_rows.get(entry_id)
+        if entry_id is None or position is None:
+            raise KeyError(f"Knowledge base entry not found: {entry_id}")
+        return position
+    
+    def _with_rows(
+        self,
+        kb_data: list,
+        doc_matrix: sparse.csr_matrix,
+        entry: Optional[Dict] = None
+    ) -> 'KnowledgeIndex':
+        """Nuovo indice con le stesse statistiche TF-IDF e una modifica in più"""
+        if self.drift + 1 > self.refit_threshold * self.fit_size:
+            # Vocabolario e idf troppo distanti dal corpus: fit completo
+            return KnowledgeIndex(kb_data, self.refit_threshold)
+        if entry is not None and self._needs_refit(entry):
+            # Parole mai viste dal fit corrente: senza refit la voce non
+            # sarebbe trovabile con i suoi termini nuovi
+            return KnowledgeIndex(kb_data, self.refit_threshold)
+        
+        index = KnowledgeIndex.__new__(KnowledgeIndex)
+        return index._assemble(
+            kb_data, self.vectorizer, doc_matrix,
+            refit_threshold=self.refit_threshold,
+            fit_size=self.fit_size,
+            drift=self.drift + 1,
+            corpus_words=self._corpus_words
+        )
+    
+    def _vectorize(self, entry: Dict) -> sparse.csr_matrix:
+        return self.vectorizer.transform([self._document_text(entry)]).tocsr()
+    
+    def _words(self, doc: Dict) -> set:
+        """Unigrammi del documento secondo l'analyzer del vectorizer"""
+        return {
+            term for term in self.vectorizer.build_analyzer()(self._document_text(doc))
+            if ' ' not in term
+        }
+    
+    def _needs_refit(self, entry: Dict) -> bool:
+        """
+        True se la voce introduce parole assenti dal corpus dell'ultimo fit,
+        o se la sua riga risulta vuota con il vocabolario corrente.
+        
+        Le parole già presenti nel corpus ma escluse da max_features non
+        contano: un refit non le aggiungerebbe comunque.
+        """
+        if self._corpus_words is None:
+            # Calcolato alla prima modifica, poi ereditato dagli indici derivati
+            self._corpus_words = frozenset().union(*(self._words(doc) for doc in self.kb_data))
+        words = self._words(entry)
+        return bool(words - self._corpus_words) or (bool(words) and self._vectorize(entry).nnz == 0)
+    
+    def add_entry(self, entry: Dict) -> 'KnowledgeIndex':
+        """
+        Aggiunge un documento (copy-on-write).
+        
+        Args:
+            entry: Documento con almeno il campo 'id'
+        
+        Returns:
+            KnowledgeIndex: Nuovo indice; quello corrente resta invariato
+        
+        Raises:
+            ValueError: Se manca l'id o l'id esiste già
+        """
+        entry_id = entry.get('id')
+        if entry_id is None:
+            raise ValueError("Knowledge base entry requires an 'id'")
+        if entry_id in self.id_rows:
+            raise ValueError(f"Knowledge base entry already exists: {entry_id}")
+        
+        kb_data = list(self.kb_data) + [dict(entry)]
+        if self.doc_matrix is None:
+            return KnowledgeIndex(kb_data, self.refit_threshold)
+        
+        doc_matrix = sparse.vstack([self.doc_matrix, self._vectorize(entry)], format='csr')
+        return self._with_rows(kb_data, doc_matrix, entry)
+    
+    def update_entry(self, entry: Dict) -> 'KnowledgeIndex':
+        """
+        Sostituisce il documento con lo stesso 'id' (copy-on-write).
+        
+        Args:
+            entry: Nuova versione completa del documento
+        
+        Returns:
+            KnowledgeIndex: Nuovo indice; quello corrente resta invariato
+        
+        Raises:
+            KeyError: Se l'id non esiste
+        """
+        position = self._position(entry.get('id'))
+        
+        kb_data = list(self.kb_data)
+        kb_data[position] = dict(entry)
+        doc_matrix = sparse.vstack([
+            self.doc_matrix[:position],
+            self._vectorize(entry),
+            self.doc_matrix[position + 1:]
+        ], format='csr')
+        return self._with_rows(kb_data, doc_matrix, entry)
+    
+    def remove_entry(self, entry_id: str) -> 'KnowledgeIndex':
+        """
+        Rimuove il documento con l'id indicato (copy-on-write).
+        
+        Args:
+            entry_id: Id del documento
+        
+        Returns:
+            KnowledgeIndex: Nuovo indice; quello corrente resta invariato
+        
+        Raises:
+            KeyError: Se l'id non esiste
+        """
+        position = self._position(entry_id)
+        
+        kb_data = self.kb_data[:position] + self.kb_data[position + 1:]
+        if not kb_data:
+            return KnowledgeIndex(kb_data, self.refit_threshold)
+        
+        doc_matrix = sparse.vstack([
+            self.doc_matrix[:position],
+            self.doc_matrix[position + 1:]
+        ], format='csr')
+        return self._with_rows(kb_data, doc_matrix)
+    
+    def save(self, index_path: str):
+        """
+        Salva l'indice su disco in formato .npz (nessun pickle).
+        
+        Args:
+            index_path: Path del file .npz di destinazione
+        """
+        if self.doc_matrix is None:
+            raise ValueError("Cannot save an empty knowledge index")
+        
+        # Vocabolario come array di termini ordinato per colonna
+        terms = np.empty(len(self.vectorizer.vocabulary_), dtype=object)
+        for term, col in self.vectorizer.vocabulary_.items():
+            terms[col] = term
+        
+        np.savez_compressed(
+            index_path,
+            data=self.doc_matrix.data,
+            indices=self.doc_matrix.indices,
+            indptr=self.doc_matrix.indptr,
+            shape=np.array(self.doc_matrix.shape),
+            idf=self.vectorizer.idf_,
+            vocabulary=terms.astype(str),
+            fingerprint=np.array(self.fingerprint)
+        )
+    
+    @classmethod
+    def load(cls, index_path: str, kb_data: list, refit_threshold: float = 0.2) -> 'KnowledgeIndex':
+        """
+        Carica un indice salvato con save(), senza rifittare.
+        
+        Args:
+            index_path: Path del file .npz
+            kb_data: Knowledge base da cui l'indice è stato costruito
+            refit_threshold: Vedi __init__
+        
+        Returns:
+            KnowledgeIndex: Indice pronto per le query
+        
+        Raises:
+            FileNotFoundError: Se il file non esiste
+            ValueError: Se l'indice non corrisponde alla knowledge base
+        """
+        with np.load(index_path, allow_pickle=False) as archive:
+            fingerprint = str(archive['fingerprint'])
+            kb_list = _as_documents(kb_data)
+            if fingerprint != _kb_fingerprint(kb_list):
+                raise ValueError(f"Index {index_path} does not match the knowledge base")
+            
+            doc_matrix = sparse.csr_matrix(
+                (archive['data'], archive['indices'], archive['indptr']),
+                shape=tuple(archive['shape'])
+            )
+            
+            vocabulary = {str(term): col for col, term in enumerate(archive['vocabulary'])}
+            vectorizer = TfidfVectorizer(vocabulary=vocabulary, **TFIDF_PARAMS)
+            vectorizer.idf_ = archive['idf']
+            # Stato "fittato" completo: transform() non muta il vectorizer
+            vectorizer.vocabulary_ = vocabulary
+            vectorizer.fixed_vocabulary_ = True
+        
+        index = cls.__new__(cls)
+        return index._assemble(
+            kb_list, vectorizer, doc_matrix,
+            refit_threshold=refit_threshold, fingerprint=fingerprint
+        )
+
+
+class KnowledgeSnapshot(NamedTuple):
+    """
+    Versione immutabile di knowledge base + indice.
+    
+    Chi legge prende il riferimento allo snapshot una volta sola e usa
+    kb_data e index coerenti tra loro; un reload ne pubblica uno nuovo con
+    un singolo assegnamento (atomico), senza lock sul percorso di lettura.
+    """
+    kb_data: list
+    index: Optional[KnowledgeIndex]
+    version: int = 0
+
+
+class QueryCache:
+    """
+    Cache LRU con TTL dei risultati di ricerca, davanti al RAG engine.
+    
+    Le chiavi sono (query normalizzata, categoria, lingua, versione KB). La
+    cache si svuota da sola quando il file della knowledge base cambia
+    (mtime/size); la versione impedisce che una ricerca fatta sullo snapshot
+    precedente, ancora in corso durante un reload, venga servita dopo.
+    
+    Examples:
+        >>> cache = QueryCache(max_entries=256, ttl_seconds=300,
+        ...                    source_path="data/hotel_knowledge_base.json")
+        >>> results = cache.get("Orari colazione", None, "it")
+        >>> if results is None:
+        ...     results = search_hotel_knowledge("Orari colazione", kb)
+        ...     cache.put("Orari colazione", None, "it", results)
+        >>> cache.stats()
+        {'hits': 0, 'misses': 1, 'evictions': 0, 'invalidations': 0, 'size': 1, ...}
+    
+    Note:
+        - I risultati in cache sono condivisi: trattarli come read-only
+        - max_entries <= 0 disabilita la cache
+        - Thread-safe: un lock protegge l'ordine LRU e i contatori
+    """
+    
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl_seconds: float = 300.0,
+        source_path: Optional[str] = None
+    ):
+        """
+        Args:
+            max_entries: Numero massimo di query in cache (LRU oltre il limite)
+            ttl_seconds: Validità di ogni entry in secondi
+            source_path: File KB da monitorare per l'invalidazione (opzionale)
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.source_path = source_path
+        self._entries: "OrderedDict[Tuple, Tuple[float, tuple]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._source_signature = self._read_source_signature()
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Normalizza la query: minuscolo e spazi compattati"""
+        return ' '.join((query or '').lower().split())
+    
+    def _key(self, query: str, category: Optional[str], language: str, version: int) -> Tuple:
+        return (self.normalize_query(query), category, language, version)
+    
+    def _read_source_signature(self) -> Optional[Tuple[int, int]]:
+        if not self.source_path:
+            return None
+        try:
+            stat = os.stat(self.source_path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+    
+    def _check_source(self):
+        """Invalida tutta la cache se il file KB è cambiato"""
+        if not self.source_path:
+            return
+        signature = self._read_source_signature()
+        if signature != self._source_signature:
+            with self._lock:
+                if signature == self._source_signature:
+                    return
+                self._source_signature = signature
+            self.invalidate()
+    
+    def get(
+        self,
+        query: str,
+        category: Optional[str],
+        language: str,
+        version: int = 0
+    ) -> Optional[list]:
+        """
+        Restituisce i risultati in cache, None se assenti o scaduti.
+        
+        Args:
+            query: Query dell'ospite (viene normalizzata)
+            category: Categoria della ricerca (o None)
+            language: Lingua dell'ospite
+            version: Versione dello snapshot KB su cui è stata fatta la ricerca
+        
+        Returns:
+            list | None: Risultati memorizzati, None in caso di miss
+        """
+        if self.max_entries <= 0:
+            return None
+        
+        self._check_source()
+        key = self._key(query, category, language, version)
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return list(entry[1])
+    
+    def put(
+        self,
+        query: str,
+        category: Optional[str],
+        language: str,
+        results: list,
+        version: int = 0
+    ):
+        """
+        Memorizza i risultati di una ricerca.
+        
+        Args:
+            query: Query dell'ospite (viene normalizzata)
+            category: Categoria della ricerca (o None)
+            language: Lingua dell'ospite
+            results: Risultati da memorizzare
+            version: Versione dello snapshot KB da cui provengono i risultati
+        """
+        if self.max_entries <= 0:
+            return
+        
+        key = self._key(query, category, language, version)
+        entry = (time.monotonic() + self.ttl_seconds, tuple(results))
+        
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def invalidate(self):
+        """Svuota la cache (es. dopo un reload della KB)"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def stats(self) -> Dict[str, float]:
+        """
+        Contatori per il dimensionamento della cache.
+        
+        Returns:
+            dict: {hits, misses, evictions, invalidations, size, hit_rate}
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'size': len(self._entries),
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
 
 def search_hotel_knowledge(
     query: str, 
     kb_data: list,
-    category: Optional[str] = None
+    category: Optional[str] = None,
+    index: Optional[KnowledgeIndex] = None,
+    top_k: int = 5,
+    as_dicts: bool = False
 ) -> list:
     """
     Cerca nella knowledge base hotel/città usando TF-IDF e cosine similarity.
@@ -24,10 +1056,17 @@ def search_hotel_knowledge(
         category: Filtra per categoria specifica (opzionale)
                   Valori: 'hotel_services', 'local_attractions', 'dining', 
                          'transport', 'policies', 'spa_wellness'
+        index: KnowledgeIndex pre-fittato su kb_data (opzionale).
+               Se assente, l'indice viene costruito al volo sul
+               sottoinsieme filtrato
+        top_k: Numero massimo di risultati (default 5)
+        as_dicts: True per ricevere dict indipendenti (vedi results_as_dicts)
     
     Returns:
-        list: Lista di documenti rilevanti ordinati per relevance score.
-              Ogni elemento contiene: {id, category, question, answer, score}
+        list: SearchResult rilevanti ordinati per relevance score.
+              Ogni elemento espone: {id, category, question, answer, score}
+              in sola lettura; con as_dicts=True una lista di dict
+              serializzabili e modificabili
     
     Examples:
         >>> kb = load_knowledge_base()
@@ -37,13 +1076,31 @@ def search_hotel_knowledge(
     
     Note:
         - Usa TF-IDF vectorization per similarity search
-        - Restituisce top 5 risultati
+        - Restituisce i top_k risultati (default 5)
         - Score normalizzato tra 0 e 1
+        - Passare un index evita il refit del vectorizer ad ogni query
+        - I SearchResult referenziano i documenti della KB senza copiarli:
+          json.dumps e l'assegnazione di chiavi richiedono as_dicts=True
     """
+    results = _search_results(query, kb_data, category, index, top_k)
+    return results_as_dicts(results) if as_dicts else results
+
+
+def _search_results(
+    query: str,
+    kb_data: list,
+    category: Optional[str],
+    index: Optional[KnowledgeIndex],
+    top_k: int
+) -> list:
+    """Corpo di search_hotel_knowledge: restituisce sempre SearchResult"""
     if not kb_data or not query:
         return []
     
     try:
+        if index is not None:
+            return index.search(query, category=category, top_k=top_k)
+        
         # Filtra per categoria se specificata
         filtered_kb = kb_data
         if category:
@@ -52,84 +1109,172 @@ def search_hotel_knowledge(
         if not filtered_kb:
             return []
         
-        # Prepara i testi per TF-IDF
-        # Combina question + answer per search migliore
-        documents = [
-            f"{doc.get('question', '')} {doc.get('answer', '')}" 
-            for doc in filtered_kb
-        ]
-        
-        # TF-IDF Vectorization
-        vectorizer = TfidfVectorizer(
-            lowercase=True,
-            ngram_range=(1, 2),  # unigrams e bigrams
-            max_features=500,
-            stop_words=None  # Manteniamo stop words per italiano
-        )
-        
-        # Fit sui documenti
-        tfidf_matrix = vectorizer.fit_transform(documents)
-        
-        # Transform query
-        query_vector = vectorizer.transform([query.lower()])
-        
-        # Calcola cosine similarity
-        similarities = cosine_similarity(query_vector, tfidf_matrix)[0]
-        
-        # Ottieni top k risultati
-        top_k = 5
-        top_indices = np.argsort(similarities)[::-1][:top_k]
-        
-        # Build results
-        results = []
-        for idx in top_indices:
-            if similarities[idx] > 0:  # Solo risultati con score > 0
-                doc = filtered_kb[idx].copy()
-                doc['score'] = float(similarities[idx])
-                results.append(doc)
-        
-        return results
+        # Indice ad-hoc sul sottoinsieme filtrato
+        return KnowledgeIndex(filtered_kb).search(query, top_k=top_k)
     
     except Exception as e:
         print(f"Error in search_hotel_knowledge: {e}")
         # Fallback: simple keyword match
-        return _fallback_keyword_search(query, kb_data, category)
+        keyword_index = index.keyword_index if index is not None else None
+        return _fallback_keyword_search(
+            query, kb_data, category, top_k=top_k, keyword_index=keyword_index
+        )
+
+
+def search_hotel_knowledge_batch(
+    queries: List[str],
+    kb_data: list,
+    category: Optional[str] = None,
+    index: Optional[KnowledgeIndex] = None,
+    top_k: int = 5,
+    as_dicts: bool = False
+) -> List[list]:
+    """
+    Versione batch di search_hotel_knowledge per replay e load testing.
+    
+    Args:
+        queries: Lista di query degli ospiti
+        kb_data: Knowledge base (stesso formato di search_hotel_knowledge)
+        category: Filtra per categoria specifica (opzionale)
+        index: KnowledgeIndex pre-fittato su kb_data (opzionale). Se assente,
+               come in search_hotel_knowledge l'indice viene fittato sul
+               sottoinsieme filtrato, quindi score e ranking coincidono
+        top_k: Numero massimo di risultati per query
+        as_dicts: True per ricevere dict indipendenti (vedi results_as_dicts)
+    
+    Returns:
+        list: Una lista di risultati per query, ciascuna nel formato
+              di search_hotel_knowledge
+    
+    Examples:
+        >>> kb = load_knowledge_base()
+        >>> batch = search_hotel_knowledge_batch(["wifi", "orari colazione"], kb)
+        >>> print(batch[1][0]['id'])
+        'service_001'
+    """
+    queries = list(queries)
+    if not kb_data or not queries:
+        return [[] for _ in queries]
+    
+    try:
+        if index is not None:
+            batch = index.search_batch(queries, category=category, top_k=top_k)
+        else:
+            # Stesso fit della ricerca singola senza indice: solo la categoria
+            filtered_kb = kb_data
+            if category:
+                filtered_kb = [doc for doc in kb_data if doc.get('category') == category]
+            batch = (
+                KnowledgeIndex(filtered_kb).search_batch(queries, top_k=top_k)
+                if filtered_kb else [[] for _ in queries]
+            )
+    
+    except Exception as e:
+        print(f"Error in search_hotel_knowledge_batch: {e}")
+        keyword_index = index.keyword_index if index is not None else KeywordIndex(kb_data)
+        batch = [
+            keyword_index.search(query, category=category, top_k=top_k) if query else []
+            for query in queries
+        ]
+    
+    return [results_as_dicts(results) for results in batch] if as_dicts else batch
 
 
 def _fallback_keyword_search(
     query: str,
     kb_data: list,
-    category: Optional[str] = None
+    category: Optional[str] = None,
+    top_k: int = 5,
+    keyword_index: Optional[KeywordIndex] = None,
+    as_dicts: bool = False
 ) -> list:
-    """Fallback search usando simple keyword matching"""
-    query_lower = query.lower()
-    query_words = set(query_lower.split())
+    """
+    Fallback search usando simple keyword matching.
     
-    results = []
-    for doc in kb_data:
-        if category and doc.get('category') != category:
-            continue
-        
-        doc_text = f"{doc.get('question', '')} {doc.get('answer', '')}".lower()
-        doc_words = set(doc_text.split())
+    Con un keyword_index pre-costruito lo scoring tocca solo i documenti che
+    condividono un token con la query; senza, l'indice viene costruito al volo.
+    Restituisce SearchResult, o dict indipendenti con as_dicts=True.
+    """
+    if keyword_index is None:
+        keyword_index = KeywordIndex(kb_data)
+    results = keyword_index.search(query, category=category, top_k=top_k)
+    return results_as_dicts(results) if as_dicts else results
+
+
+class ResponseCache:
+    """
+    Memo LRU limitato delle risposte renderizzate da generate_concierge_response.
+    
+    La chiave è (versione KB, lingua, id dei documenti mostrati, fascia di
+    score): due contesti con la stessa chiave producono esattamente lo stesso
+    testo, quindi le FAQ più richieste saltano del tutto la formattazione.
+    
+    Note:
+        - Le fasce di score coincidono con le soglie usate nel rendering
+          (0.3 per la sezione correlati, 0.25 per ogni voce)
+        - Va svuotata con clear() se il testo dei documenti cambia
+        - Thread-safe: un lock protegge l'ordine LRU
+    """
+    
+    def __init__(self, max_entries: int = 512):
+        """
+        Args:
+            max_entries: Numero massimo di risposte memorizzate
+        """
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def make_key(context: List[Dict], guest_language: str, version: int = 0) -> Optional[Tuple]:
+        """Chiave di memo per il contesto, None se non memoizzabile"""
+        shown = context[:3]
+        doc_ids = tuple(doc.get('id') for doc in shown)
+        if None in doc_ids:
+            return None
         
-        # Calcola intersection
-        common_words = query_words.intersection(doc_words)
-        if common_words:
-            score = len(common_words) / len(query_words)
-            doc_copy = doc.copy()
-            doc_copy['score'] = score
-            results.append(doc_copy)
+        score_bucket = tuple(doc.get('score', 0) > 0.25 for doc in shown[1:])
+        has_related = len(context) > 1 and context[1].get('score', 0) > 0.3
+        return (version, guest_language, doc_ids, has_related, score_bucket)
+    
+    def get(self, key: Tuple) -> Optional[str]:
+        with self._lock:
+            response = self._entries.get(key)
+            if response is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return response
+    
+    def put(self, key: Tuple, response: str):
+        with self._lock:
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        """Svuota il memo (es. dopo una modifica della KB)"""
+        with self._lock:
+            self._entries.clear()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
     
-    # Ordina per score
-    results.sort(key=lambda x: x['score'], reverse=True)
-    return results[:5]
+    def stats(self) -> Dict[str, int]:
+        """Contatori hit/miss e dimensione corrente"""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
 
 
 def generate_concierge_response(
     query: str,
     context: List[Dict],
-    guest_language: str = 'it'
+    guest_language: str = 'it',
+    response_cache: Optional[ResponseCache] = None,
+    cache_version: int = 0
 ) -> str:
     """
     Genera risposta in stile concierge professionale basata sul contesto.
@@ -138,6 +1283,8 @@ def generate_concierge_response(
         query: Domanda originale dell'ospite
         context: Lista di documenti rilevanti dalla KB (output di search_hotel_knowledge)
         guest_language: Lingua dell'ospite ('it' o 'en')
+        response_cache: Memo delle risposte renderizzate (opzionale)
+        cache_version: Versione dello snapshot KB da cui proviene il contesto
     
     Returns:
         str: Risposta formattata in stile concierge professionale
@@ -156,6 +1303,7 @@ def generate_concierge_response(
         - Usa il documento con score più alto
         - Aggiunge informazioni correlate se disponibili
         - Stile: formale, cortese, chiaro
+        - Con response_cache, contesti equivalenti riusano la risposta già formattata
     """
     if not context:
         # No relevant information found
@@ -172,53 +1320,68 @@ def generate_concierge_response(
                 "You can also contact the reception at internal number 0."
             )
     
+    if response_cache is None:
+        return _render_concierge_response(context, guest_language)
+    
+    key = ResponseCache.make_key(context, guest_language, cache_version)
+    if key is None:
+        return _render_concierge_response(context, guest_language)
+    
+    response = response_cache.get(key)
+    if response is None:
+        response = _render_concierge_response(context, guest_language)
+        response_cache.put(key, response)
+    return response
+
+
+def _render_concierge_response(context: List[Dict], guest_language: str) -> str:
+    """Formatta la risposta a partire da un contesto non vuoto"""
     # Usa il documento con score più alto
     main_doc = context[0]
     answer = main_doc.get('answer', '')
     
     if guest_language == 'it':
-        # Risposta in italiano
-        response = f"{answer}\n\n"
-        
-        # Aggiungi informazioni correlate se ci sono altri risultati rilevanti
-        if len(context) > 1 and context[1].get('score', 0) > 0.3:
-            response += "📌 Informazioni correlate:\n"
-            for i, doc in enumerate(context[1:3], 1):
-                if doc.get('score', 0) > 0.25:
-                    response += f"• {doc.get('question', 'Info')}\n"
-        
-        # Chiusura cortese
-        response += "\nSono a disposizione per ulteriori informazioni. Come posso esserle ancora utile?"
-        
+        related_title = "📌 Informazioni correlate:\n"
+        closing = "\nSono a disposizione per ulteriori informazioni. Come posso esserle ancora utile?"
     else:
         # Risposta in inglese (translation would require API)
-        response = f"{answer}\n\n"
-        
-        if len(context) > 1 and context[1].get('score', 0) > 0.3:
-            response += "📌 Related information:\n"
-            for i, doc in enumerate(context[1:3], 1):
-                if doc.get('score', 0) > 0.25:
-                    response += f"• {doc.get('question', 'Info')}\n"
-        
-        response += "\nI'm at your disposal for further information. How else may I assist you?"
+        related_title = "📌 Related information:\n"
+        closing = "\nI'm at your disposal for further information. How else may I assist you?"
     
-    return response
+    parts = [answer, "\n\n"]
+    
+    # Aggiungi informazioni correlate se ci sono altri risultati rilevanti
+    if len(context) > 1 and context[1].get('score', 0) > 0.3:
+        parts.append(related_title)
+        for doc in context[1:3]:
+            if doc.get('score', 0) > 0.25:
+                parts.append(f"• {doc.get('question', 'Info')}\n")
+    
+    # Chiusura cortese
+    parts.append(closing)
+    return ''.join(parts)
 
 
 def load_knowledge_base(kb_path: str = "data/hotel_knowledge_base.json") -> list:
     """
-    Carica la knowledge base da file JSON.
+    Carica la knowledge base da file JSON o compilato.
     
     Args:
-        kb_path: Path al file JSON della knowledge base
+        kb_path: Path al file JSON della knowledge base, oppure al file
+                 prodotto da compile_knowledge_base (riconosciuto dal magic)
     
     Returns:
-        list: Knowledge base caricata
+        list: Knowledge base caricata (CompiledKnowledgeBase, sequenza
+              read-only mappata in memoria, per il formato compilato)
     
     Raises:
         FileNotFoundError: Se il file non esiste
         json.JSONDecodeError: Se il file non è un JSON valido
+        ValueError: Se il file compilato non è valido
     """
+    if is_compiled_knowledge_base(kb_path):
+        return CompiledKnowledgeBase(kb_path)
+    
     try:
         with open(kb_path, 'r', encoding='utf-8') as f:
             kb_data = json.load(f)
@@ -2,61 +2,328 @@
 Gestione Richieste di Servizio
 Gestisce creazione, tracking e formattazione delle richieste di servizio
 """
+import json
+import os
 import sqlite3
+import threading
 import uuid
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, Iterable, Optional
 from pathlib import Path
 
+from keyword_matcher import SHARED_MATCHER, URGENT_KEYWORDS, CRITICAL_MAINTENANCE_KEYWORDS
 
-def _get_db_connection(db_path: str = "data/hotel_database.sqlite") -> sqlite3.Connection:
+
+DEFAULT_DB_PATH = "data/hotel_database.sqlite"
+
+
+class ConnectionPool:
+    """
+    Pool di connessioni SQLite thread-local per un database.
+    
+    Ogni thread riceve una connessione persistente, aperta una sola volta
+    con WAL e pragma ottimizzati, invece di un sqlite3.connect per chiamata.
+    
+    Examples:
+        >>> pool = get_connection_pool("data/hotel_database.sqlite")
+        >>> conn = pool.get_connection()
+        >>> conn.execute("SELECT COUNT(*) FROM service_requests").fetchone()
+    
+    Note:
+        - Le connessioni restituite non vanno chiuse dal chiamante
+        - WAL permette letture concorrenti durante le scritture
+        - synchronous=NORMAL è sicuro in WAL e riduce gli fsync
+        - Ogni connessione è usata solo dal suo thread; il pool la chiude
+          quando il thread termina (alla prima nuova connessione) o in close_all()
+    """
+    
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA busy_timeout=5000",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA cache_size=-8000"  # ~8MB di page cache per connessione
+    )
+    
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        """
+        Args:
+            db_path: Path al database SQLite
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: Dict[threading.Thread, sqlite3.Connection] = {}
+    
+    def _connect(self) -> sqlite3.Connection:
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        # check_same_thread=False solo per poter chiudere dal pool le
+        # connessioni di altri thread: le query restano nel thread proprietario
+        conn = sqlite3.connect(self.db_path, timeout=5.0, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # Abilita accesso dict-like
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        return conn
+    
+    def get_connection(self) -> sqlite3.Connection:
+        """
+        Restituisce la connessione del thread corrente, aprendola se serve.
+        
+        Returns:
+            sqlite3.Connection: Connessione riusabile del thread
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._close_dead_threads()
+                self._connections[threading.current_thread()] = conn
+        return conn
+    
+    def _close_dead_threads(self):
+        """Chiude le connessioni dei thread terminati. Chiamare con _lock"""
+        dead = [thread for thread in self._connections if not thread.is_alive()]
+        for thread in dead:
+            _close_quietly(self._connections.pop(thread))
+    
+    def close_all(self):
+        """Chiude tutte le connessioni aperte dal pool (es. allo shutdown)"""
+        with self._lock:
+            connections, self._connections = self._connections, {}
+        for conn in connections.values():
+            _close_quietly(conn)
+        self._local = threading.local()
+
+
+def _close_quietly(conn: sqlite3.Connection):
+    try:
+        conn.close()
+    except sqlite3.Error as e:
+        print(f"⚠️ Errore chiusura connessione SQLite: {e}")
+
+
+_POOLS: Dict[str, ConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_connection_pool(db_path: str = DEFAULT_DB_PATH) -> ConnectionPool:
     """
-    Ottiene connessione al database SQLite.
+    Restituisce il pool condiviso per il database indicato.
     
     Args:
         db_path: Path al database SQLite
     
     Returns:
-        sqlite3.Connection: Connessione al database
+        ConnectionPool: Pool unico per path assoluto
     """
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row  # Abilita accesso dict-like
-    return conn
+    key = os.path.abspath(db_path)
+    pool = _POOLS.get(key)
+    if pool is None:
+        with _POOLS_LOCK:
+            pool = _POOLS.get(key)
+            if pool is None:
+                pool = ConnectionPool(db_path)
+                _POOLS[key] = pool
+    return pool
 
 
-def _initialize_database(db_path: str = "data/hotel_database.sqlite"):
+def _get_db_connection(db_path: str = DEFAULT_DB_PATH) -> sqlite3.Connection:
     """
-    Inizializza il database se non esiste.
+    Ottiene connessione al database SQLite dal pool thread-local.
     
     Args:
-        db_path: Path al database
+        db_path: Path al database SQLite
+    
+    Returns:
+        sqlite3.Connection: Connessione al database (da non chiudere)
     """
-    db_file = Path(db_path)
+    return get_connection_pool(db_path).get_connection()
+
+
+# Schema di riferimento distribuito con il progetto
+_PACKAGED_SCHEMA_FILE = Path(__file__).resolve().parent.parent / "data" / "init_db.sql"
+
+
+def _apply_base_schema(conn: sqlite3.Connection, db_path: str):
+    """Migrazione 1: schema base e dati di esempio da init_db.sql"""
+    schema_file = Path(db_path).parent / "init_db.sql"
+    if not schema_file.exists():
+        schema_file = _PACKAGED_SCHEMA_FILE
+    with open(schema_file, 'r', encoding='utf-8') as f:
+        conn.executescript(f.read())
+
+
+def _add_conversation_messages(conn: sqlite3.Connection, db_path: str):
+    """
+    Migrazione 2: messaggi append-only per sessione di conversazione.
     
-    # Crea directory se non esiste
-    db_file.parent.mkdir(parents=True, exist_ok=True)
+    I turni legacy (array JSON in conversations.messages) vengono copiati
+    nella nuova tabella, così la storia è interrogabile senza parsing JSON.
+    """
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS conversation_messages (
+            conversation_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            role TEXT NOT NULL, -- 'guest', 'bot'
+            content TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (conversation_id, seq),
+            FOREIGN KEY (conversation_id) REFERENCES conversations(conversation_id)
+        ) WITHOUT ROWID;
+        
+        CREATE INDEX IF NOT EXISTS idx_conversations_guest_created
+            ON conversations(guest_id, created_at);
+    """)
     
-    # Leggi e esegui schema SQL
-    schema_file = db_file.parent / "init_db.sql"
-    if schema_file.exists():
-        conn = _get_db_connection(db_path)
+    legacy = conn.execute("""
+        SELECT conversation_id, messages, created_at FROM conversations
+        WHERE messages IS NOT NULL
+    """).fetchall()
+    
+    for conversation_id, messages_json, created_at in legacy:
         try:
-            with open(schema_file, 'r', encoding='utf-8') as f:
-                schema_sql = f.read()
-            conn.executescript(schema_sql)
-            conn.commit()
-        except Exception as e:
-            print(f"Error initializing database: {e}")
-        finally:
-            conn.close()
+            messages = json.loads(messages_json)
+        except (TypeError, ValueError):
+            continue
+        conn.executemany("""
+            INSERT OR IGNORE INTO conversation_messages
+            (conversation_id, seq, role, content, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, [
+            (conversation_id, seq, msg.get('role', ''), msg.get('content', ''), created_at)
+            for seq, msg in enumerate(messages)
+            if isinstance(msg, dict)
+        ])
 
 
-def create_service_request(
+# Migrazioni esplicite: (versione, descrizione, funzione(conn, db_path)).
+# La versione applicata è tracciata con PRAGMA user_version
+MIGRATIONS = [
+    (1, "base schema (guests, service_requests, conversations)", _apply_base_schema),
+    (2, "session-based conversation_messages table", _add_conversation_messages),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+_INITIALIZED_DATABASES = set()
+_INIT_LOCK = threading.Lock()
+
+
+def initialize_database(db_path: str = DEFAULT_DB_PATH) -> int:
+    """
+    Bootstrap versionato dello schema, da eseguire una volta all'avvio.
+    
+    Applica in ordine le migrazioni con versione maggiore di
+    PRAGMA user_version e aggiorna la versione dopo ciascuna.
+    
+    Args:
+        db_path: Path al database
+    
+    Returns:
+        int: Versione dello schema dopo il bootstrap
+    
+    Raises:
+        RuntimeError: Se una migrazione fallisce
+    
+    Note:
+        - Dopo la prima chiamata per un path, le successive non fanno I/O
+        - Le migrazioni devono essere idempotenti (IF NOT EXISTS, OR IGNORE)
+    """
+    key = os.path.abspath(db_path)
+    if key in _INITIALIZED_DATABASES:
+        return SCHEMA_VERSION
+    
+    with _INIT_LOCK:
+        if key in _INITIALIZED_DATABASES:
+            return SCHEMA_VERSION
+        
+        conn = _get_db_connection(db_path)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        
+        for target, description, migrate in MIGRATIONS:
+            if target <= version:
+                continue
+            try:
+                migrate(conn, db_path)
+                conn.execute(f"PRAGMA user_version = {int(target)}")
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise RuntimeError(
+                    f"Database migration {target} ({description}) failed: {e}"
+                )
+            version = target
+        
+        _INITIALIZED_DATABASES.add(key)
+        return version
+
+
+def _ensure_schema(db_path: str = DEFAULT_DB_PATH):
+    """Hot path: solo un lookup in memoria se il bootstrap è già avvenuto"""
+    if os.path.abspath(db_path) not in _INITIALIZED_DATABASES:
+        initialize_database(db_path)
+
+
+VALID_REQUEST_TYPES = ['room_service', 'housekeeping', 'maintenance', 
+                       'concierge', 'spa_booking', 'restaurant_booking']
+
+_INSERT_REQUEST_SQL = """
+    INSERT INTO service_requests 
+    (request_id, guest_id, room_number, request_type, details, status, priority, created_at)
+    VALUES (:request_id, :guest_id, :room_number, :request_type, :details,
+            :status, :priority, :created_at)
+"""
+
+
+def _build_request_record(
     guest_id: str,
     room_number: str,
     request_type: str,
     details: str,
     priority: Optional[str] = None
+) -> dict:
+    """
+    Valida i dati e costruisce il record completo di una nuova richiesta.
+    
+    Raises:
+        ValueError: Se request_type non è valido
+    """
+    # Validazione request_type
+    if request_type not in VALID_REQUEST_TYPES:
+        raise ValueError(
+            f"Invalid request_type '{request_type}'. "
+            f"Must be one of: {', '.join(VALID_REQUEST_TYPES)}"
+        )
+    
+    # Auto-determina priority se non specificata
+    if priority is None:
+        priority = _determine_priority(request_type, details)
+    
+    # Genera request_id univoco
+    request_id = f"SR-{uuid.uuid4().hex[:8].upper()}"
+    
+    # created_at nello stesso formato testuale letto da get_request_status
+    return {
+        'request_id': request_id,
+        'guest_id': guest_id,
+        'room_number': room_number,
+        'request_type': request_type,
+        'details': details,
+        'status': 'pending',
+        'priority': priority,
+        'created_at': datetime.now().isoformat(' '),
+        'completed_at': None
+    }
+
+
+def create_service_request(
+    guest_id: str,
+    room_number: str,
+    request_type: str,
+    details: str,
+    priority: Optional[str] = None,
+    db_path: str = DEFAULT_DB_PATH
 ) -> dict:
     """
     Crea richiesta di servizio nel sistema.
@@ -70,6 +337,7 @@ def create_service_request(
         details: Descrizione dettagliata della richiesta
         priority: Priorità ('low', 'normal', 'high', 'urgent')
                   Se None, viene auto-determinata
+        db_path: Path al database SQLite
     
     Returns:
         dict: Dati della richiesta creata con tutti i campi incluso request_id
@@ -92,46 +360,92 @@ def create_service_request(
         - request_id viene generato automaticamente (formato: SR-uuid)
         - status iniziale è sempre 'pending'
         - created_at viene impostato automaticamente
+        - Una sola operazione sul database: il record restituito non viene riletto
     """
-    # Validazione request_type
-    valid_types = ['room_service', 'housekeeping', 'maintenance', 
-                   'concierge', 'spa_booking', 'restaurant_booking']
+    request = _build_request_record(guest_id, room_number, request_type, details, priority)
     
-    if request_type not in valid_types:
-        raise ValueError(
-            f"Invalid request_type '{request_type}'. "
-            f"Must be one of: {', '.join(valid_types)}"
-        )
-    
-    # Auto-determina priority se non specificata
-    if priority is None:
-        priority = _determine_priority(request_type, details)
-    
-    # Genera request_id univoco
-    request_id = f"SR-{uuid.uuid4().hex[:8].upper()}"
+    # Bootstrap schema (no-op dopo il primo avvio)
+    _ensure_schema(db_path)
     
-    # Inizializza database se necessario
-    _initialize_database()
-    
-    conn = _get_db_connection()
+    conn = _get_db_connection(db_path)
     try:
         cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO service_requests 
-            (request_id, guest_id, room_number, request_type, details, status, priority, created_at)
-            VALUES (?, ?, ?, ?, ?, 'pending', ?, ?)
-        """, (request_id, guest_id, room_number, request_type, details, priority, datetime.now()))
+        cursor.execute(_INSERT_REQUEST_SQL, request)
         
         conn.commit()
-        
-        # Recupera e restituisci la richiesta creata
-        return get_request_status(request_id)
+        return request
     
     except sqlite3.Error as e:
         conn.rollback()
         raise RuntimeError(f"Database error creating service request: {e}")
-    finally:
-        conn.close()
+
+
+def create_service_requests_bulk(
+    requests: Iterable[Dict],
+    db_path: str = DEFAULT_DB_PATH
+) -> Dict[str, list]:
+    """
+    Importa molte richieste in un'unica transazione (eventi, conferenze).
+    
+    Args:
+        requests: Iterabile di dizionari con chiavi guest_id, room_number,
+                  request_type, details e priority opzionale
+        db_path: Path al database SQLite
+    
+    Returns:
+        dict: {
+            'created': lista dei record inseriti (stesso formato di create_service_request),
+            'errors': lista di {'index': int, 'error': str} per le righe scartate
+        }
+    
+    Raises:
+        RuntimeError: Se l'inserimento fallisce (nessuna riga viene salvata)
+    
+    Examples:
+        >>> report = create_service_requests_bulk([
+        ...     {"guest_id": "G001", "room_number": "305",
+        ...      "request_type": "housekeeping", "details": "Asciugamani extra"},
+        ...     {"guest_id": "G002", "room_number": "412",
+        ...      "request_type": "laundry", "details": "Camicie"}
+        ... ])
+        >>> len(report['created']), report['errors'][0]['index']
+        (1, 1)
+    
+    Note:
+        - Validazione e priorità automatica riga per riga (_determine_priority)
+        - Le righe valide vengono inserite con executemany in un solo commit
+    """
+    created = []
+    errors = []
+    
+    for index, item in enumerate(requests):
+        try:
+            created.append(_build_request_record(
+                guest_id=item['guest_id'],
+                room_number=item['room_number'],
+                request_type=item['request_type'],
+                details=item['details'],
+                priority=item.get('priority')
+            ))
+        except KeyError as e:
+            errors.append({'index': index, 'error': f"Missing field: {e.args[0]}"})
+        except (ValueError, TypeError, AttributeError) as e:
+            errors.append({'index': index, 'error': str(e)})
+    
+    if not created:
+        return {'created': created, 'errors': errors}
+    
+    _ensure_schema(db_path)
+    
+    conn = _get_db_connection(db_path)
+    try:
+        conn.executemany(_INSERT_REQUEST_SQL, created)
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        raise RuntimeError(f"Database error creating service requests: {e}")
+    
+    return {'created': created, 'errors': errors}
 
 
 def _determine_priority(request_type: str, details: str) -> str:
@@ -145,18 +459,16 @@ def _determine_priority(request_type: str, details: str) -> str:
     Returns:
         str: Priorità ('low', 'normal', 'high', 'urgent')
     """
-    details_lower = details.lower()
+    # Tutte le keyword (urgenti e critiche) in una sola passata
+    found = SHARED_MATCHER.find(details.lower())
     
     # Keywords urgenti
-    urgent_keywords = ['urgente', 'urgent', 'subito', 'immediately', 'asap', 'emergenza']
-    if any(kw in details_lower for kw in urgent_keywords):
+    if any(kw in found for kw in URGENT_KEYWORDS):
         return 'urgent'
     
     # Manutenzione critica
     if request_type == 'maintenance':
-        critical_keywords = ['acqua', 'water', 'leak', 'perdita', 'allagamento',
-                           'elettric', 'luce', 'riscaldamento', 'aria condizionata']
-        if any(kw in details_lower for kw in critical_keywords):
+        if any(kw in found for kw in CRITICAL_MAINTENANCE_KEYWORDS):
             return 'high'
         return 'normal'
     
@@ -171,12 +483,13 @@ def _determine_priority(request_type: str, details: str) -> str:
     return 'normal'
 
 
-def get_request_status(request_id: str) -> dict:
+def get_request_status(request_id: str, db_path: str = DEFAULT_DB_PATH) -> dict:
     """
     Recupera stato e dettagli di una richiesta dal database.
     
     Args:
         request_id: ID della richiesta (formato: SR-XXXXXXXX)
+        db_path: Path al database SQLite
     
     Returns:
         dict: Dizionario con tutti i campi della richiesta:
@@ -194,9 +507,9 @@ def get_request_status(request_id: str) -> dict:
     Note:
         - completed_at è None se richiesta non ancora completata
     """
-    _initialize_database()
+    _ensure_schema(db_path)
     
-    conn = _get_db_connection()
+    conn = _get_db_connection(db_path)
     try:
         cursor = conn.cursor()
         cursor.execute("""
@@ -215,22 +528,27 @@ def get_request_status(request_id: str) -> dict:
     
     except sqlite3.Error as e:
         raise RuntimeError(f"Database error retrieving request: {e}")
-    finally:
-        conn.close()
 
 
-def update_request_status(request_id: str, new_status: str) -> bool:
+def update_request_status(
+    request_id: str,
+    new_status: str,
+    db_path: str = DEFAULT_DB_PATH
+) -> bool:
     """
     Aggiorna lo stato di una richiesta.
     
     Args:
         request_id: ID della richiesta
         new_status: Nuovo stato ('pending', 'in_progress', 'completed')
+        db_path: Path al database SQLite
     
     Returns:
         bool: True se aggiornamento riuscito, False se richiesta non trovata
     """
-    conn = _get_db_connection()
+    _ensure_schema(db_path)
+    
+    conn = _get_db_connection(db_path)
     try:
         cursor = conn.cursor()
         
@@ -254,8 +572,6 @@ def update_request_status(request_id: str, new_status: str) -> bool:
     except sqlite3.Error as e:
         conn.rollback()
         raise RuntimeError(f"Database error updating request: {e}")
-    finally:
-        conn.close()
 
 
 def format_service_confirmation(request_data: dict) -> str:
@@ -346,36 +662,40 @@ Grazie per aver scelto i nostri servizi! 🌟"""
     return confirmation
 
 
-def get_guest_requests(guest_id: str, status_filter: Optional[str] = None) -> list:
+def get_guest_requests(
+    guest_id: str,
+    status_filter: Optional[str] = None,
+    db_path: str = DEFAULT_DB_PATH
+) -> list:
     """
     Recupera tutte le richieste di un ospite.
     
     Args:
         guest_id: ID ospite
         status_filter: Filtra per status (opzionale)
+        db_path: Path al database SQLite
     
     Returns:
         list: Lista di richieste (dizionari)
     """
-    conn = _get_db_connection()
-    try:
-        cursor = conn.cursor()
-        
-        if status_filter:
-            cursor.execute("""
-                SELECT * FROM service_requests
-                WHERE guest_id = ? AND status = ?
-                ORDER BY created_at DESC
-            """, (guest_id, status_filter))
-        else:
-            cursor.execute("""
-                SELECT * FROM service_requests
-                WHERE guest_id = ?
-                ORDER BY created_at DESC
-            """, (guest_id,))
-        
-        rows = cursor.fetchall()
-        return [dict(row) for row in rows]
+    _ensure_schema(db_path)
+    
+    conn = _get_db_connection(db_path)
+    cursor = conn.cursor()
+    
+    if status_filter:
+        cursor.execute("""
+            SELECT * FROM service_requests
+            WHERE guest_id = ? AND status = ?
+            ORDER BY created_at DESC
+        """, (guest_id, status_filter))
+    else:
+        cursor.execute("""
+            SELECT * FROM service_requests
+            WHERE guest_id = ?
+            ORDER BY created_at DESC
+        """, (guest_id,))
+    
+    rows = cursor.fetchall()
+    return [dict(row) for row in rows]
     
-    finally:
-        conn.close()
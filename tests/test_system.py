@@ -2,15 +2,36 @@
 Test Suite Completo per Hotel Concierge Bot
 Esegui con: pytest tests/test_system.py -v
 """
+import asyncio
+import json
+import sqlite3
 import sys
 import os
+import threading
+import time
+from pathlib import Path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
 import pytest
-from intent_classifier import classify_guest_intent, get_intent_confidence
-from rag_engine import search_hotel_knowledge, generate_concierge_response, load_knowledge_base
-from service_manager import create_service_request, get_request_status, format_service_confirmation
+from intent_classifier import (
+    classify_guest_intent, get_intent_confidence, IntentClassifier, analyze_guest_message,
+    RECOMMENDATION_CATEGORY_KEYWORDS, SERVICE_TYPE_KEYWORDS
+)
+from rag_engine import (
+    search_hotel_knowledge, search_hotel_knowledge_batch, generate_concierge_response,
+    load_knowledge_base, KnowledgeIndex, QueryCache, ResponseCache, SearchResult,
+    _fallback_keyword_search
+)
+from service_manager import (
+    create_service_request, get_request_status, format_service_confirmation, _determine_priority,
+    get_connection_pool, initialize_database, SCHEMA_VERSION, create_service_requests_bulk
+)
+from keyword_matcher import KeywordMatcher, SHARED_MATCHER
+from kb_compiled import CompiledKnowledgeBase, compile_knowledge_base
+from conversation_store import ConversationStore, ConversationWriter
+from escalation_tracker import EscalationTracker
 from concierge_bot import HotelConciergeBot
+from async_bot import AsyncHotelConciergeBot
 
 
 class TestIntentClassification:
@@ -50,6 +71,47 @@ class TestIntentClassification:
         intent, confidence = get_intent_confidence("A che ora è la colazione?")
         assert intent == "hotel_info"
         assert 0.0 <= confidence <= 1.0
+    
+    def test_compiled_classifier(self):
+        """Test classificatore pre-compilato: intent e confidenza insieme"""
+        classifier = IntentClassifier()
+        assert classifier.classify("A che ora è la colazione?") == ("hotel_info", 0.7)
+        assert classifier.classify("Posso avere la colazione? vorrei prenotare") == ("service_request", 0.7)
+        assert classifier.classify("La camera non è pulita, not clean") == ("complaint", 0.5)
+        assert classifier.classify("") == ("special_request", 0.3)
+        assert classifier.classify(None) == ("special_request", 0.3)
+    
+    def test_classification_result_keywords(self):
+        """Test risultato di classificazione riusabile dagli handler"""
+        result = analyze_guest_message("Vorrei prenotare un tavolo al ristorante")
+        assert result.intent == "service_request"
+        assert result.scores['service_request'] >= 1
+        assert "ristorante" in result.matched_keywords
+        assert result.first_match(SERVICE_TYPE_KEYWORDS) == "restaurant_booking"
+        
+        # Match per sottostringa come negli handler storici
+        result = analyze_guest_message("Vorrei degli asciugamani")
+        assert result.first_match(SERVICE_TYPE_KEYWORDS) == "housekeeping"
+        assert analyze_guest_message("Cosa visitare?").first_match(RECOMMENDATION_CATEGORY_KEYWORDS) == "local_attractions"
+
+
+class TestKeywordMatcher:
+    """Test automa Aho-Corasick condiviso"""
+    
+    def test_finds_all_overlapping_keywords(self):
+        """Test hit sovrapposti in una sola passata"""
+        matcher = KeywordMatcher(['visit', 'visitare', 'sit', 'spa', 'asap'])
+        assert matcher.find("vorrei visitare la spa asap") == {'visit', 'visitare', 'sit', 'spa', 'asap'}
+        assert matcher.find("nessuna keyword") == frozenset()
+        assert matcher.matches_any("spa", ['asap', 'spa'])
+    
+    def test_shared_matcher_vocabularies(self):
+        """Test automa condiviso usato da priorità ed escalation"""
+        found = SHARED_MATCHER.find("perdita d'acqua urgente, ho un problema")
+        assert {'perdita', 'acqua', 'urgente', 'problem'} <= found
+        assert _determine_priority('maintenance', "Perdita d'acqua in bagno") == 'high'
+        assert _determine_priority('room_service', "Caffè subito per favore") == 'urgent'
+        assert _determine_priority('spa_booking', "Massaggio domani") == 'low'
 
 
 class TestRAGEngine:
@@ -95,6 +157,236 @@ class TestRAGEngine:
         assert len(response) > 0
         assert isinstance(response, str)
     
+    def test_knowledge_index_search(self, kb_data):
+        """Test indice pre-fittato equivalente alla ricerca ad-hoc"""
+        index = KnowledgeIndex(kb_data)
+        expected = search_hotel_knowledge("orari colazione", kb_data)
+        results = search_hotel_knowledge("orari colazione", kb_data, index=index)
+        assert [r['id'] for r in results] == [r['id'] for r in expected]
+        assert results[0]['score'] == pytest.approx(expected[0]['score'])
+    
+    def test_knowledge_index_save_load(self, kb_data, tmp_path):
+        """Test persistenza indice senza refit"""
+        index_path = str(tmp_path / "kb_index.npz")
+        KnowledgeIndex(kb_data).save(index_path)
+        
+        loaded = KnowledgeIndex.load(index_path, kb_data)
+        results = loaded.search("wifi gratuito")
+        assert len(results) > 0
+        assert results[0]['id'] == "service_004"
+        
+        # Indice non coerente con la KB viene rifiutato
+        with pytest.raises(ValueError):
+            KnowledgeIndex.load(index_path, kb_data[:-1])
+    
+    def test_knowledge_index_category_filter(self, kb_data):
+        """Test filtro categoria sulla sottomatrice precalcolata"""
+        index = KnowledgeIndex(kb_data)
+        matrix, rows = index._select_rows("dining")
+        assert matrix is index.category_matrices["dining"]
+        assert (matrix != index.doc_matrix[rows]).nnz == 0
+        
+        results = search_hotel_knowledge("ristorante", kb_data, category="dining", index=index)
+        assert len(results) > 0
+        assert all(r['category'] == "dining" for r in results)
+        
+        dining = index.category_documents("dining")
+        assert [d['id'] for d in dining] == [d['id'] for d in kb_data if d['category'] == "dining"]
+        assert index.search("ristorante", category="unknown_category") == []
+    
+    def test_search_batch_matches_single(self, kb_data):
+        """Test ricerca batch coerente con le ricerche singole"""
+        index = KnowledgeIndex(kb_data)
+        queries = ["orari colazione", "wifi gratuito", "", "ristorante veneziano"]
+        batch = search_hotel_knowledge_batch(queries, kb_data, index=index)
+        
+        assert len(batch) == len(queries)
+        assert batch[2] == []
+        for query, results in zip(queries, batch):
+            expected = search_hotel_knowledge(query, kb_data, index=index)
+            assert [r['id'] for r in results] == [r['id'] for r in expected]
+        
+        dining = search_hotel_knowledge_batch(["ristorante"], kb_data, category="dining", top_k=2)
+        assert 0 < len(dining[0]) <= 2
+        assert all(r['category'] == "dining" for r in dining[0])
+        
+        # Senza indice: stesso fit sul sottoinsieme filtrato della ricerca singola
+        for category in ("dining", "spa_wellness", "transport"):
+            expected = search_hotel_knowledge("orari prenotazione", kb_data, category, None, 3)
+            results = search_hotel_knowledge_batch(["orari prenotazione"], kb_data, category, None, 3)[0]
+            assert [(r['id'], r['score']) for r in results] == [(r['id'], r['score']) for r in expected]
+    
+    def test_top_k_parameter(self, kb_data):
+        """Test top_k pubblico su ricerca TF-IDF e fallback keyword"""
+        results = search_hotel_knowledge("orari della spa e colazione", kb_data, top_k=2)
+        assert len(results) == 2
+        assert results[0]['score'] >= results[1]['score']
+        
+        fallback = _fallback_keyword_search("orari della colazione", kb_data, top_k=3)
+        assert len(fallback) == 3
+        scores = [r['score'] for r in fallback]
+        assert scores == sorted(scores, reverse=True)
+    
+    def test_incremental_entry_mutations(self, kb_data):
+        """Test add/update/remove: indice aggiornato senza refit, snapshot precedente intatto"""
+        index = KnowledgeIndex(kb_data, refit_threshold=0.2)
+        # Solo parole già presenti nel corpus: aggiornamento incrementale
+        entry = {"id": "dining_new", "category": "dining",
+                 "question": kb_data[1]['question'], "answer": kb_data[2]['answer']}
+        
+        added = index.add_entry(entry)
+        assert added.vectorizer is index.vectorizer and added.drift == 1
+        assert added.category_documents('dining')[-1]['id'] == "dining_new"
+        assert "dining_new" not in index.id_rows
+        
+        updated = added.update_entry(dict(kb_data[0], answer="La colazione è servita in terrazza"))
+        top = updated.search("colazione")[0]
+        assert top['id'] == kb_data[0]['id'] and "terrazza" in top['answer']
+        # Stessa riga calcolata da zero con vocabolario e idf correnti
+        expected = updated.vectorizer.transform([KnowledgeIndex._document_text(top)])
+        assert abs(updated.doc_matrix[0] - expected).max() < 1e-12
+        
+        removed = updated.remove_entry(kb_data[0]['id'])
+        assert len(removed) == len(kb_data) and kb_data[0]['id'] not in removed.id_rows
+        with pytest.raises(KeyError):
+            removed.remove_entry(kb_data[0]['id'])
+        with pytest.raises(ValueError):
+            removed.add_entry(entry)
+        
+        # Oltre la soglia di drift: fit completo
+        mutated = removed
+        while mutated.drift:
+            mutated = mutated.update_entry(dict(kb_data[1], answer=kb_data[3]['answer']))
+        assert mutated.vectorizer is not index.vectorizer
+    
+    def test_mutation_with_new_words_is_searchable(self, kb_data):
+        """Test voce con parole nuove per il corpus: refit immediato, trovabile subito"""
+        index = KnowledgeIndex(kb_data)
+        spa = next(doc for doc in kb_data if doc['id'] == "spa_002")
+        
+        updated = index.update_entry(dict(spa, answer="Noleggio biciclette elettriche alla reception"))
+        assert updated.vectorizer is not index.vectorizer and updated.drift == 0
+        assert [r['id'] for r in updated.search("noleggio biciclette")][:1] == ["spa_002"]
+        
+        added = index.add_entry({"id": "dining_gino", "category": "dining",
+                                 "question": "C'è una pizzeria?", "answer": "Pizzeria Da Gino, a due passi"})
+        assert [r['id'] for r in added.search("pizzeria")][:1] == ["dining_gino"]
+    
+    def test_compiled_knowledge_base(self, kb_data, tmp_path):
+        """Test KB compilata: stessi documenti e risultati del JSON, via mmap"""
+        odd = {"id": "odd_1", "question": "Senza categoria", "answer": None, "tags": ["x"]}
+        source = list(kb_data) + [odd]
+        path = str(tmp_path / "kb.hkb")
+        fingerprint = compile_knowledge_base(source, path)
+        
+        compiled = load_knowledge_base(path)
+        assert isinstance(compiled, CompiledKnowledgeBase)
+        assert list(compiled) == source
+        assert compiled[-1] == odd and compiled.category_codes.flags.writeable is False
+        
+        index = KnowledgeIndex(source)
+        compiled_index = KnowledgeIndex(compiled)
+        assert compiled_index.fingerprint == index.fingerprint == fingerprint
+        assert compiled_index.id_rows == index.id_rows
+        for query in ("orari colazione", "ristorante veneziano", "wifi gratuito"):
+            assert compiled_index.search(query) == index.search(query)
+        
+        index_path = str(tmp_path / "index.npz")
+        index.save(index_path)
+        assert KnowledgeIndex.load(index_path, compiled).search("spa") == index.search("spa")
+    
+    def test_search_results_reference_kb(self, kb_data):
+        """Test SearchResult: vista sul documento KB senza copia"""
+        index = KnowledgeIndex(kb_data)
+        result = index.search("orari colazione")[0]
+        
+        assert isinstance(result, SearchResult)
+        assert result.document is index.kb_data[result.position]
+        assert result['score'] == result.get('score') == result.score
+        assert 'score' in result and 'score' not in result.document
+        assert result.to_dict() == {**result.document, 'score': result.score}
+        assert result == result.to_dict()
+        assert result.with_score(1.0).document is result.document
+        
+        # Vista dict opzionale: serializzabile e modificabile
+        dicts = search_hotel_knowledge("orari colazione", kb_data, index=index, as_dicts=True)
+        assert dicts == index.search("orari colazione")
+        assert json.loads(json.dumps(dicts)) == dicts
+        dicts[0]['score'] = 0.0
+        assert index.search("orari colazione")[0]['score'] > 0
+    
+    def test_keyword_index_fallback(self, kb_data):
+        """Test fallback keyword su indice invertito pre-costruito"""
+        index = KnowledgeIndex(kb_data)
+        assert "colazione" in index.keyword_index.postings
+        
+        results = _fallback_keyword_search(
+            "orari colazione", kb_data, category="hotel_services",
+            keyword_index=index.keyword_index
+        )
+        assert results == _fallback_keyword_search("orari colazione", kb_data, category="hotel_services")
+        assert all(r['category'] == "hotel_services" for r in results)
+        assert _fallback_keyword_search("xyz123", kb_data, keyword_index=index.keyword_index) == []
+        
+        # Spareggi per doc id anche se le postings non sono ordinate
+        keyword_index = index.keyword_index
+        for word in ("orari", "hotel", "servizio"):
+            keyword_index.postings.get(word, []).reverse()
+        positions = {doc['id']: pos for pos, doc in enumerate(kb_data)}
+        ranked = [
+            (-r['score'], positions[r['id']])
+            for r in keyword_index.search("orari hotel servizio", top_k=len(kb_data))
+        ]
+        assert len(ranked) > 3 and ranked == sorted(ranked)
+        top = keyword_index.search("orari hotel servizio", top_k=3)
+        assert [(-r['score'], positions[r['id']]) for r in top] == ranked[:3]
+    
+    def test_query_cache_lru_ttl(self, kb_data):
+        """Test cache query: normalizzazione, LRU e TTL"""
+        cache = QueryCache(max_entries=2, ttl_seconds=60)
+        results = search_hotel_knowledge("orari colazione", kb_data)
+        
+        assert cache.get("orari colazione", None, "it") is None
+        cache.put("orari colazione", None, "it", results)
+        assert cache.get("  Orari   COLAZIONE ", None, "it") == results
+        assert cache.get("orari colazione", None, "en") is None
+        
+        cache.put("wifi", None, "it", [])
+        cache.put("spa", None, "it", [])
+        assert cache.get("orari colazione", None, "it") is None  # evicted
+        assert cache.stats()['evictions'] == 1
+        
+        expired = QueryCache(max_entries=10, ttl_seconds=-1)
+        expired.put("wifi", None, "it", results)
+        assert expired.get("wifi", None, "it") is None
+    
+    def test_query_cache_invalidated_on_kb_change(self, tmp_path):
+        """Test invalidazione cache quando il file KB cambia"""
+        kb_file = tmp_path / "kb.json"
+        kb_file.write_text("[]", encoding="utf-8")
+        cache = QueryCache(source_path=str(kb_file))
+        cache.put("wifi", None, "it", [{"id": "x"}])
+        assert cache.get("wifi", None, "it") is not None
+        
+        kb_file.write_text('[{"id": "y"}]', encoding="utf-8")
+        assert cache.get("wifi", None, "it") is None
+        assert cache.stats()['invalidations'] == 1
+    
+    def test_response_cache_memoizes_render(self, kb_data):
+        """Test memo delle risposte renderizzate"""
+        cache = ResponseCache(max_entries=8)
+        results = search_hotel_knowledge("orari colazione", kb_data)
+        
+        plain = generate_concierge_response("orari colazione", results, "it")
+        first = generate_concierge_response("orari colazione", results, "it", cache)
+        second = generate_concierge_response("A che ora è la colazione?", results, "it", cache)
+        assert first == plain == second
+        assert cache.stats()['hits'] == 1
+        
+        english = generate_concierge_response("breakfast", results, "en", cache)
+        assert english != first
+        assert len(cache) == 2
+    
     def test_no_results_fallback(self, kb_data):
         """Test fallback quando non ci sono risultati"""
         response = generate_concierge_response(
@@ -161,6 +453,39 @@ class TestServiceManagement:
         assert status is not None
         assert status['request_id'] == request['request_id']
     
+    def test_created_request_matches_stored_row(self, tmp_path):
+        """Test record restituito identico alla riga salvata"""
+        db_path = str(tmp_path / "requests.sqlite")
+        request = create_service_request(
+            guest_id="TEST006",
+            room_number="999",
+            request_type="concierge",
+            details="Prenotazione gondola",
+            db_path=db_path
+        )
+        assert request == get_request_status(request['request_id'], db_path=db_path)
+        get_connection_pool(db_path).close_all()
+    
+    def test_bulk_service_requests(self, tmp_path):
+        """Test import massivo con report errori per riga"""
+        db_path = str(tmp_path / "bulk.sqlite")
+        report = create_service_requests_bulk([
+            {"guest_id": "TEST007", "room_number": "999",
+             "request_type": "housekeeping", "details": "Asciugamani extra"},
+            {"guest_id": "TEST007", "room_number": "999",
+             "request_type": "laundry", "details": "Camicie"},
+            {"guest_id": "TEST007", "room_number": "999", "request_type": "maintenance"},
+            {"guest_id": "TEST007", "room_number": "999",
+             "request_type": "maintenance", "details": "Perdita d'acqua urgente"},
+        ], db_path=db_path)
+        
+        assert len(report['created']) == 2
+        assert [e['index'] for e in report['errors']] == [1, 2]
+        assert report['created'][1]['priority'] == 'urgent'
+        for request in report['created']:
+            assert get_request_status(request['request_id'], db_path=db_path) == request
+        get_connection_pool(db_path).close_all()
+    
     def test_format_confirmation(self):
         """Test formattazione conferma"""
         request = create_service_request(
@@ -175,6 +500,155 @@ class TestServiceManagement:
         assert len(confirmation) > 0
         assert request['request_id'] in confirmation
         assert "✅" in confirmation  # Check emoji
+    
+    def test_connection_pool_thread_local(self, tmp_path):
+        """Test pool: connessione riusata per thread, WAL attivo"""
+        pool = get_connection_pool(str(tmp_path / "pool.sqlite"))
+        assert get_connection_pool(str(tmp_path / "pool.sqlite")) is pool
+        
+        conn = pool.get_connection()
+        assert pool.get_connection() is conn
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        
+        other = []
+        worker = threading.Thread(target=lambda: other.append(pool.get_connection()))
+        worker.start()
+        worker.join()
+        assert other[0] is not conn
+        
+        # La connessione del thread terminato viene chiusa alla successiva apertura
+        fresh = threading.Thread(target=pool.get_connection)
+        fresh.start()
+        fresh.join()
+        assert worker not in pool._connections
+        with pytest.raises(sqlite3.ProgrammingError):
+            other[0].execute("SELECT 1")
+        
+        # close_all chiude anche le connessioni aperte da altri thread
+        connections = list(pool._connections.values())
+        pool.close_all()
+        for closed in connections:
+            with pytest.raises(sqlite3.ProgrammingError):
+                closed.execute("SELECT 1")
+    
+    def test_schema_bootstrap_versioned(self, tmp_path):
+        """Test bootstrap schema tracciato con PRAGMA user_version"""
+        db_path = str(tmp_path / "schema.sqlite")
+        assert initialize_database(db_path) == SCHEMA_VERSION
+        
+        conn = get_connection_pool(db_path).get_connection()
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        assert {'guests', 'service_requests', 'conversations'} <= tables
+        
+        # Chiamate successive: nessuna migrazione rieseguita
+        assert initialize_database(db_path) == SCHEMA_VERSION
+        get_connection_pool(db_path).close_all()
+
+
+class TestConversationStore:
+    """Test persistenza conversazioni"""
+    
+    def test_write_behind_batches_and_flush(self, tmp_path):
+        """Test writer in background: batch, flush e close"""
+        db_path = str(tmp_path / "conv.sqlite")
+        writer = ConversationWriter(db_path, batch_size=10, flush_interval=5.0)
+        for i in range(5):
+            writer.submit({
+                "conversation_id": f"CONV-WB-{i}", "guest_id": "WB",
+                "room_number": "999", "language": "it", "is_new": True,
+                "messages": [{"role": "guest", "content": "Ciao"}]
+            })
+        
+        writer.flush()
+        conn = get_connection_pool(db_path).get_connection()
+        count = conn.execute("SELECT COUNT(*) FROM conversations WHERE guest_id = 'WB'").fetchone()[0]
+        assert count == 5
+        assert writer.stats()['batches'] == 1
+        
+        writer.close()
+        writer.submit({
+            "conversation_id": "CONV-WB-late", "guest_id": "WB",
+            "room_number": "999", "language": "it", "is_new": True,
+            "messages": []
+        })
+        assert writer.stats()['sync_writes'] == 1
+        get_connection_pool(db_path).close_all()
+    
+    def test_close_racing_submits_loses_nothing(self, tmp_path):
+        """Test close() concorrente con submit(): ogni turno viene scritto"""
+        db_path = str(tmp_path / "race.sqlite")
+        writer = ConversationWriter(db_path, flush_interval=0.01)
+        
+        def submit_many(worker):
+            for i in range(50):
+                writer.submit({
+                    "conversation_id": f"CONV-RACE-{worker}-{i}", "guest_id": "RACE",
+                    "room_number": "999", "language": "it", "is_new": True, "messages": []
+                })
+        
+        threads = [threading.Thread(target=submit_many, args=(w,)) for w in range(4)]
+        for thread in threads:
+            thread.start()
+        writer.close()
+        for thread in threads:
+            thread.join()
+        
+        conn = get_connection_pool(db_path).get_connection()
+        assert conn.execute("SELECT COUNT(*) FROM conversations WHERE guest_id = 'RACE'").fetchone()[0] == 200
+        assert writer._queue.qsize() == 0
+        get_connection_pool(db_path).close_all()
+    
+    def test_session_keeps_every_turn(self, tmp_path):
+        """Test sessione: stesso conversation_id, nessun turno perso nello stesso secondo"""
+        db_path = str(tmp_path / "conv.sqlite")
+        writer = ConversationWriter(db_path)
+        store = ConversationStore(db_path, writer=writer)
+        
+        ids = {store.append_turn("SS", "305", "it", f"Domanda {i}", f"Risposta {i}") for i in range(10)}
+        assert len(ids) == 1
+        
+        conv_id = ids.pop()
+        messages = store.get_messages(conv_id)
+        assert [m['seq'] for m in messages] == list(range(20))
+        assert messages[-1]['role'] == 'bot'
+        assert messages[-1]['content'] == "Risposta 9"
+        
+        conn = get_connection_pool(db_path).get_connection()
+        assert conn.execute("SELECT COUNT(*) FROM conversations WHERE guest_id = 'SS'").fetchone()[0] == 1
+        
+        writer.close()
+        get_connection_pool(db_path).close_all()
+    
+    def test_expired_sessions_evicted(self, tmp_path):
+        """Test sessioni scadute rimosse dalla memoria"""
+        db_path = str(tmp_path / "expiry.sqlite")
+        store = ConversationStore(db_path, session_ttl_seconds=0.05)
+        for guest_id in ("EXP1", "EXP2"):
+            store.append_turn(guest_id, "305", "it", "Ciao", "Benvenuto!")
+        
+        time.sleep(0.1)
+        assert store.purge_expired() == 2
+        assert store.get_conversation_id("EXP1") is None
+        get_connection_pool(db_path).close_all()
+    
+    def test_legacy_json_conversations_migrated(self, tmp_path):
+        """Test migrazione: i turni JSON legacy diventano righe interrogabili"""
+        db_path = str(tmp_path / "legacy.sqlite")
+        conn = sqlite3.connect(db_path)
+        conn.executescript((Path(__file__).parent.parent / "data" / "init_db.sql").read_text())
+        conn.execute(
+            "INSERT INTO conversations (conversation_id, guest_id, messages) VALUES (?, ?, ?)",
+            ("CONV-OLD-1", "OLD", json.dumps([{"role": "guest", "content": "Ciao"},
+                                             {"role": "bot", "content": "Salve"}]))
+        )
+        conn.commit()
+        conn.close()
+        
+        initialize_database(db_path)
+        store = ConversationStore(db_path)
+        assert [m['content'] for m in store.get_messages("CONV-OLD-1")] == ["Ciao", "Salve"]
+        get_connection_pool(db_path).close_all()
 
 
 class TestHotelConciergeBot:
@@ -257,6 +731,71 @@ class TestHotelConciergeBot:
         should_escalate = bot.should_escalate_to_staff(history, "complaint")
         assert should_escalate == True
     
+    def test_escalation_tracker_matches_history_scan(self, bot):
+        """Test tracker incrementale: stesse decisioni della scansione della storia"""
+        history = [
+            {"role": "guest", "content": "Ho un problema"},
+            {"role": "bot", "content": "Mi dispiace"},
+            {"role": "guest", "content": "Domanda"},
+            {"role": "guest", "content": "Altra domanda"},
+            {"role": "guest", "content": "C'è ancora il problema"},
+            {"role": "bot", "content": "Capisco"},
+            {"role": "guest", "content": "Grazie"},
+        ] + [{"role": "bot", "content": f"Risposta {i}"} for i in range(5)]
+        
+        tracker = EscalationTracker()
+        for i in range(len(history) + 1):
+            tracker.seed("TRK", history[:i])
+            for intent in ("hotel_info", "complaint", "emergency"):
+                assert tracker.should_escalate("TRK", intent) == bot.should_escalate_to_staff(history[:i], intent)
+    
+    def test_escalation_tracker_failed_intents_and_expiry(self):
+        """Test intent falliti ripetuti e scadenza della sessione"""
+        tracker = EscalationTracker(max_failed_intents=2, session_ttl_seconds=0.05)
+        for _ in range(2):
+            tracker.record_message("FAIL", "guest", "asdf", failed_intent=True)
+            tracker.record_message("FAIL", "bot", "Può riformulare?")
+        assert tracker.should_escalate("FAIL", "special_request", failed_intent=False) is False
+        assert tracker.should_escalate("FAIL", "special_request", failed_intent=True) is True
+        
+        time.sleep(0.1)
+        assert tracker.purge_expired() == 1
+        assert tracker.should_escalate("FAIL", "special_request", failed_intent=True) is False
+    
+    def test_vectorized_personalization_matches_loop(self, bot):
+        """Test boost da matrice documento x tag: stesso risultato del loop sul testo"""
+        preferences = {"interests": ["Art", "history", "art", "spa"], "dietary": ["vegetarian"]}
+        index = bot.index
+        
+        for category in index.category_rows:
+            expected = []
+            for doc in index.category_documents(category):
+                text = f"{doc.get('question', '')} {doc.get('answer', '')}".lower()
+                score = 0.5
+                score += sum(0.2 for i in preferences["interests"] if i.lower() in text)
+                score += sum(0.15 for d in preferences["dietary"] if d.lower() in text)
+                expected.append((doc['id'], min(score, 1.0)))
+            expected.sort(key=lambda x: x[1], reverse=True)
+            
+            recs = bot.get_personalized_recommendations({"preferences": preferences}, category)
+            assert [r['id'] for r in recs] == [doc_id for doc_id, _ in expected]
+            assert [r['score'] for r in recs] == pytest.approx([score for _, score in expected])
+        
+        # Tag non precalcolato: valutato sul testo, senza far crescere la matrice
+        assert "spa" not in index.preference_tags.tags
+        assert index.preference_tags.matrix.shape == (len(index), len(index.preference_tags.tags))
+    
+    def test_recommendations_without_preferences(self, bot):
+        """Test raccomandazioni senza preferenze: stesso tipo, KB condivisa non esposta"""
+        recs = bot.get_personalized_recommendations({"preferences": {}}, "dining")
+        dining = bot.index.category_documents("dining")
+        
+        assert all(isinstance(r, SearchResult) for r in recs)
+        assert [r['id'] for r in recs] == [d['id'] for d in dining]
+        assert all(r['score'] == 0.5 for r in recs)
+        with pytest.raises(TypeError):
+            recs[0]['answer'] = "Modificata"
+    
     def test_personalized_recommendations(self, bot, guest_info):
         """Test raccomandazioni personalizzate"""
         recommendations = bot.get_personalized_recommendations(
@@ -273,6 +812,145 @@ class TestHotelConciergeBot:
             assert 'score' in recommendations[0]
 
 
+class TestConcurrency:
+    """Test Bot Condiviso tra Thread"""
+    
+    def test_shared_bot_stress(self, tmp_path):
+        """Test stress: un solo bot usato da molti thread, risultati identici al seriale"""
+        db_path = str(tmp_path / "stress.sqlite")
+        read_only = [
+            "A che ora è la colazione?", "C'è il wifi?", "A che ora è il check-out?",
+            "Mi consigli un ristorante?", "Cosa visitare a Venezia?", "Dove posso mangiare pesce?"
+        ]
+        service = "Vorrei asciugamani puliti"
+        
+        with HotelConciergeBot(db_path=db_path, write_behind=False) as reference:
+            expected = {msg: reference.process_guest_message(msg, [], {"guest_id": "REF", "language": "it"})
+                        for msg in read_only}
+        
+        # Cache piccola per forzare evizioni concorrenti
+        bot = HotelConciergeBot(db_path=db_path, cache_max_entries=3, response_cache_size=2)
+        rounds = 10
+        errors = []
+        
+        def worker(n):
+            guest_info = {"guest_id": f"STRESS{n}", "room_number": str(100 + n), "language": "it"}
+            try:
+                for i in range(rounds):
+                    msg = read_only[(n + i) % len(read_only)]
+                    assert bot.process_guest_message(msg, [], guest_info) == expected[msg]
+                    assert "SR-" in bot.process_guest_message(service, [], guest_info)
+            except Exception as e:
+                errors.append(e)
+        
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert errors == []
+        
+        bot.close()
+        conn = get_connection_pool(db_path).get_connection()
+        requests = conn.execute(
+            "SELECT COUNT(*) FROM service_requests WHERE guest_id LIKE 'STRESS%'"
+        ).fetchone()[0]
+        messages = conn.execute("""
+            SELECT COUNT(*) FROM conversation_messages m
+            JOIN conversations c USING (conversation_id)
+            WHERE c.guest_id LIKE 'STRESS%'
+        """).fetchone()[0]
+        assert requests == 16 * rounds
+        assert messages == 16 * rounds * 2 * 2
+        
+        stats = bot.query_cache.stats()
+        assert stats['size'] <= 3
+        assert stats['hits'] + stats['misses'] == 16 * rounds
+        get_connection_pool(db_path).close_all()
+
+
+class TestKnowledgeBaseReload:
+    """Test Hot Reload della Knowledge Base"""
+    
+    def test_watcher_swaps_index_and_clears_caches(self, tmp_path):
+        """Test watcher: modifica del file KB visibile senza riavvio"""
+        kb_path = tmp_path / "kb.json"
+        kb = load_knowledge_base()
+        kb_path.write_text(json.dumps(kb), encoding='utf-8')
+        guest_info = {"guest_id": "RELOAD", "language": "it"}
+        question = "A che ora è la colazione?"
+        
+        bot = HotelConciergeBot(
+            kb_path=str(kb_path), db_path=str(tmp_path / "reload.sqlite"),
+            watch_kb=True, watch_interval=0.02
+        )
+        assert "7:00" in bot.process_guest_message(question, [], guest_info)
+        
+        kb[0] = dict(kb[0], answer=kb[0]['answer'].replace("7:00", "6:30"))
+        kb_path.write_text(json.dumps(kb), encoding='utf-8')
+        
+        deadline = time.monotonic() + 5
+        while bot.index is None or bot._knowledge.version == 0:
+            assert time.monotonic() < deadline
+            time.sleep(0.02)
+        assert "6:30" in bot.process_guest_message(question, [], guest_info)
+        
+        # Un file non valido non sostituisce lo snapshot corrente
+        kb_path.write_text("{ non json", encoding='utf-8')
+        deadline = time.monotonic() + 5
+        while bot.kb_watcher.errors == 0:
+            assert time.monotonic() < deadline
+            time.sleep(0.02)
+        assert bot._knowledge.version == 1
+        assert "6:30" in bot.process_guest_message(question, [], guest_info)
+        
+        bot.close()
+        get_connection_pool(str(tmp_path / "reload.sqlite")).close_all()
+    
+    def test_bot_entry_mutation_visible_immediately(self, tmp_path):
+        """Test modifica KB dal bot: visibile alla query successiva"""
+        db_path = str(tmp_path / "mutations.sqlite")
+        bot = HotelConciergeBot(db_path=db_path, write_behind=False)
+        guest_info = {"guest_id": "MUT", "language": "it"}
+        question = "A che ora è la colazione?"
+        assert "7:00" in bot.process_guest_message(question, [], guest_info)
+        
+        entry = dict(bot.kb_data[0])
+        entry['answer'] = entry['answer'].replace("7:00", "6:30")
+        version = bot.update_entry(entry)
+        assert version == 1
+        assert "6:30" in bot.process_guest_message(question, [], guest_info)
+        
+        # L'indice pubblicato ha già l'indice invertito per il fallback
+        assert bot.index._keyword_index is not None
+        get_connection_pool(db_path).close_all()
+
+
+class TestAsyncBot:
+    """Test Bot Asincrono"""
+    
+    def test_concurrent_sessions_keep_order(self, tmp_path):
+        """Test molte sessioni concorrenti: turni di ogni ospite nell'ordine di arrivo"""
+        db_path = str(tmp_path / "async.sqlite")
+        messages = ["A che ora è la colazione?", "C'è il wifi?", "Orari della spa?"]
+        
+        async def guest(bot, guest_id):
+            guest_info = {"guest_id": guest_id, "room_number": "999", "language": "it", "preferences": {}}
+            return [await bot.process_guest_message_async(msg, guest_info=guest_info) for msg in messages]
+        
+        async def main():
+            async with AsyncHotelConciergeBot(db_path=db_path, max_workers=4) as bot:
+                responses = await asyncio.gather(*(guest(bot, f"ASYNC{i}") for i in range(20)))
+                histories = [bot.conversation_store.get_history(f"ASYNC{i}") for i in range(20)]
+            return responses, histories
+        
+        responses, histories = asyncio.run(main())
+        assert all(r for guest_responses in responses for r in guest_responses)
+        for history in histories:
+            assert [m['content'] for m in history if m['role'] == 'guest'] == messages
+        get_connection_pool(db_path).close_all()
+
+
 class TestEndToEnd:
     """Test End-to-End completi"""
     
@@ -314,6 +992,57 @@ class TestEndToEnd:
         
         # Check che il flusso sia coerente
         assert len(conversation) >= 4
+    
+    def test_server_side_history(self, tmp_path):
+        """Test storia tenuta dal bot: il client invia solo il nuovo messaggio"""
+        db_path = str(tmp_path / "history.sqlite")
+        guest_info = {"guest_id": "HIST", "room_number": "999", "language": "it", "preferences": {}}
+        
+        with HotelConciergeBot(db_path=db_path) as bot:
+            bot.process_guest_message("A che ora è la colazione?", guest_info=guest_info)
+            bot.process_guest_message("C'è il wifi?", guest_info=guest_info)
+            history = bot.conversation_store.get_history("HIST")
+            assert [m['role'] for m in history] == ['guest', 'bot', 'guest', 'bot']
+            assert history[2]['content'] == "C'è il wifi?"
+        
+        # Dopo un riavvio la sessione viene ripresa dal database
+        restarted = HotelConciergeBot(db_path=db_path, write_behind=False, history_size=3)
+        assert restarted.conversation_store.get_history("HIST") == history[-3:]
+        restarted.process_guest_message("Grazie", guest_info=guest_info)
+        conv_id = restarted.conversation_store.get_conversation_id("HIST")
+        assert len(restarted.conversation_store.get_messages(conv_id)) == 6
+        get_connection_pool(db_path).close_all()
+    
+    def test_escalation_resets_session_counters(self, tmp_path):
+        """Test escalation: i turni successivi tornano al flusso normale, anche dopo un riavvio"""
+        db_path = str(tmp_path / "escalation.sqlite")
+        guest_info = {"guest_id": "ESC", "room_number": "101", "language": "it", "preferences": {}}
+        
+        with HotelConciergeBot(db_path=db_path) as bot:
+            escalation = bot._handle_escalation("it")
+            responses = [
+                bot.process_guest_message("A che ora è la colazione?", guest_info=guest_info)
+                for _ in range(9)
+            ]
+            # Oltre 10 messaggi nella sessione: escalation al 7° turno, poi si riparte
+            assert [r == escalation for r in responses] == [False] * 6 + [True] + [False] * 2
+        
+        restarted = HotelConciergeBot(db_path=db_path, write_behind=False)
+        assert restarted.process_guest_message("C'è il wifi?", guest_info=guest_info) != escalation
+        conv_id = restarted.conversation_store.get_conversation_id("ESC")
+        assert [m['role'] for m in restarted.conversation_store.get_messages(conv_id)].count('escalation') == 1
+        get_connection_pool(db_path).close_all()
+    
+    def test_anonymous_messages_have_no_session(self, tmp_path):
+        """Test chiamanti senza guest_id: nessuna storia né contatori condivisi"""
+        db_path = str(tmp_path / "anonymous.sqlite")
+        with HotelConciergeBot(db_path=db_path) as bot:
+            for _ in range(8):
+                response = bot.process_guest_message("A che ora è la colazione?")
+                assert response != bot._handle_escalation("it")
+            assert bot.conversation_store._sessions == {}
+            assert not bot.escalation_tracker.has_session(None)
+        get_connection_pool(db_path).close_all()
 
 
 if __name__ == "__main__":